@@ -1,16 +1,160 @@
+import argparse
+import bz2
+import codecs
+import contextvars
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
 import logging
+import lzma
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
 import time
+import weakref
 
-from json import JSONDecodeError, loads
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor,
+    as_completed, wait
+)
+from itertools import chain, count, islice
+from json import JSONDecodeError, JSONDecoder, dumps, loads
 from multiprocessing.pool import ThreadPool
 from pprint import pformat
 from urllib.parse import urlencode
 from urllib.request import Request, HTTPError, URLError, urlopen
 
+try:
+    import httpx
+except ImportError:  # HTTP/2 support is optional; see HTTP2Transport.
+    httpx = None
+
 
 # Module level log.
 MODULE_LOG = logging.getLogger('GuildWars2API')
 
+# Number of rate limiter tokens requests in the current context must leave
+# for others. Background work (see CacheWarmer) sets this so that it only
+# uses spare capacity.
+_RATE_RESERVE = contextvars.ContextVar('GuildWars2API.rate_reserve',
+                                       default=0)
+
+# Priority class of requests made in the current context. See
+# RequestScheduler and request_priority().
+_PRIORITY = contextvars.ContextVar('GuildWars2API.priority',
+                                   default='normal')
+
+# The Deadline work in the current context must finish by, if any.
+_DEADLINE = contextvars.ContextVar('GuildWars2API.deadline', default=None)
+
+# The Span that work in the current context is part of. See Tracer.
+_CURRENT_SPAN = contextvars.ContextVar('GuildWars2API.span', default=None)
+
+
+def _propagating(fn):
+    """
+    Bind a function to the caller's context, so that calls made on pool
+    threads run as part of the caller's span (and anything else kept in
+    context variables). Each call runs in its own copy of the context, as
+    one context can't be entered by two threads at once.
+
+    Args:
+        fn (callable): Function to bind.
+
+    Returns (callable):
+        The bound function.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def _annotate(**kwargs):
+    """Add arguments to the current Span, if work is being traced."""
+    span = _CURRENT_SPAN.get()
+    if span is not None:
+        span.args.update(kwargs)
+
+
+def _traced(category):
+    """
+    Decorator for GW2API methods, running the method in a Span when the
+    object's session has a Tracer.
+
+    Args:
+        category (str): Span category, eg. 'refresh'.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = self._session.tracer
+            if tracer is None:
+                return method(self, *args, **kwargs)
+            with tracer.span(f'{self.__class__.__name__}.{method.__name__}',
+                             category, endpoint=self._endpoint_url):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _run_graph(tasks, executor=None):
+    """
+    Run tasks as a dependency graph: each task is started as soon as every
+    task it depends on has finished, so independent tasks run concurrently
+    and the whole graph takes about as long as its longest chain. Tasks run
+    in the caller's context (see _propagating()).
+
+    Args:
+        tasks (dict): Task name to a (dependencies, callable) tuple.
+            dependencies is an iterable of task names; callable is called
+            with a dict of the results of the tasks finished so far.
+        executor (Executor, optional): Executor to run tasks on. The caller
+            must not be one of its workers, or the run can deadlock waiting
+            on itself. Defaults to None, which uses a thread per task for the
+            duration of the run.
+
+    Returns (dict):
+        Task name to result.
+
+    Raises:
+        ValueError: If a dependency is unknown or part of a cycle.
+        Exception: The first exception raised by a task.
+    """
+    pending = dict(tasks)
+    results, running = {}, {}
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=max(1, len(tasks)),
+                                      thread_name_prefix='GW2Build')
+    try:
+        while pending or running:
+            for name in [n for n, (deps, _) in pending.items()
+                         if all(d in results for d in deps)]:
+                _, task = pending.pop(name)
+                running[executor.submit(_propagating(task),
+                                        dict(results))] = name
+            if not running:
+                raise ValueError(f'Unsatisfiable dependencies for '
+                                 f'{sorted(pending)}')
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    finally:
+        if owned:
+            executor.shutdown(wait=not running, cancel_futures=True)
+    return results
+
 
 class AuthorizationRequiredError(Exception):
     """
@@ -35,545 +179,5366 @@ class APIError(Exception):
     pass
 
 
-class GW2APISession(object):
-    """Session object. Keeps the token."""
-    _base_url = 'https://api.guildwars2.com'
+class DeadlineExceeded(APIError):
+    """
+    Error to be raised if a request can't complete before the current
+    Deadline. Bulk fetches attach what they got before the deadline as
+    partial.
+    """
+    partial = None
 
-    def __init__(self):
+
+class Endpoint(object):
+    """
+    Declarative description of an API endpoint. Every request made through a
+    GW2APISession is matched against ENDPOINTS, and the match decides how ids
+    are batched, whether and for how long responses are cached, and which
+    token scopes are needed.
+    """
+    def __init__(self, path, bulk=False, all=True, page_size=200,
+                 auth=False, scopes=(), ttl=0, shared=None, cost=1):
         """
-        Prepares a session for use.
+        Prepares an Endpoint for use.
+
+        Args:
+            path (str): Path template, with {name} placeholders for path
+                parameters, eg. 'v2/guild/{id}'.
+            bulk (bool, optional): Whether the endpoint accepts ids=1,2,3.
+                Defaults to False.
+            all (bool, optional): Whether a bulk endpoint accepts ids=all as
+                well. If it doesn't, ids=all requests are made as pages of
+                the endpoint's id list instead. Defaults to True.
+            page_size (int, optional): Most ids allowed in one bulk request.
+                Defaults to 200.
+            auth (bool, optional): Whether a token is required. Defaults to
+                False.
+            scopes (iterable, optional): Token scopes required.
+            ttl (float, optional): Seconds a response may be cached for.
+                Defaults to 0, which never caches.
+            shared (bool, optional): Whether cached responses may be shared
+                between tokens. Defaults to None, which shares them if the
+                endpoint doesn't require auth.
+            cost (int, optional): Rate limiter tokens each request takes.
+                Defaults to 1.
         """
-        self.__token = None
-        self.token_info = None
-        self._log.debug(f'Initialized {self}')
+        self.path = path
+        self.bulk = bulk
+        self.all = all
+        self.page_size = page_size
+        self.auth = auth
+        self.scopes = tuple(scopes)
+        self.ttl = ttl
+        self.shared = not auth if shared is None else shared
+        self.cost = cost
+        self._pattern = re.compile(
+            '^' + re.sub(r'\\\{\w+\\\}', '[^/]+', re.escape(path)) + '$'
+        )
 
     def __repr__(self):
-        state = 'Unauthenticated' \
-            if self.token_info is None \
-            else f'Authenticated with {str(self.token_info)}'
-        return f'<{self.__class__.__name__} {state}>'
+        return f'<{self.__class__.__name__} {self.path}>'
 
     @property
-    def token(self):
-        """Get the token value."""
-        return self.__token
-
-    @token.setter
-    def token(self, value):
-        """
-        Sets the token value, and makes an API call to get token info, storing
-        it in self.token_info.
-        """
-        self._log.debug(f'Setting token to {value}')
-        self.__token = value
-        self.token_info = Token(session=self)
-        self._log.debug(f'token_info updated with {self.token_info}')
+    def templated(self):
+        """Whether the path has placeholders."""
+        return '{' in self.path
 
     @property
-    def _log(self):
-        """Logger"""
-        return logging.getLogger(f'GuildWars2API.{self.__class__.__name__}')
+    def placeholders(self):
+        """Names of the path's placeholders, in order."""
+        return tuple(re.findall(r'\{(\w+)\}', self.path))
 
-    @property
-    def _headers(self):
-        """Get a dictionary of headers."""
-        if self.token:
-            return {'Authorization': f'Bearer {self.token}'}
-        return {}
+    def matches(self, url):
+        """Whether a request URL is for this endpoint."""
+        return self._pattern.match(url) is not None
 
-    def make_request(self, url, params=None, data=None, headers=None):
-        """
-        Make an API request.
+    def url(self, **kwargs):
+        """Fill in the path template."""
+        return self.path.format(**kwargs)
 
-        Args:
-            url (str): Endpoint URL to call.
-            params (dict, optional): Parameters to add to the URL.
-            data (dict, optional): Data to send in the request payload.
-            headers (dict, optional): Headers to send on the request. Starts
-                with the self._headers, and updates that dictionary with these
-                values.
 
-        Returns (dict):
-            Dictionary converted from the JSON data returned.
+# Registry of every endpoint the library knows about, by name.
+ENDPOINTS = {
+    'tokeninfo': Endpoint('v2/tokeninfo', auth=True),
+    'build': Endpoint('v2/build', ttl=300),
+    'account': Endpoint('v2/account', auth=True, scopes=['account']),
+    'bank': Endpoint('v2/account/bank', auth=True,
+                     scopes=['account', 'inventories']),
+    'materials': Endpoint('v2/account/materials', auth=True,
+                          scopes=['account', 'inventories']),
+    'wallet': Endpoint('v2/account/wallet', auth=True,
+                       scopes=['account', 'wallet']),
+    'account_achievements': Endpoint('v2/account/achievements', auth=True,
+                                     scopes=['account', 'progression']),
+    'characters': Endpoint('v2/characters', bulk=True, auth=True,
+                           scopes=['account', 'characters']),
+    'guild': Endpoint('v2/guild/{id}', ttl=300, shared=False),
+    'guild_search': Endpoint('v2/guild/search', ttl=300),
+    'guild_log': Endpoint('v2/guild/{id}/log', auth=True,
+                          scopes=['account', 'guilds']),
+    'guild_members': Endpoint('v2/guild/{id}/members', auth=True,
+                              scopes=['account', 'guilds']),
+    'guild_stash': Endpoint('v2/guild/{id}/stash', auth=True,
+                            scopes=['account', 'guilds']),
+    'guild_treasury': Endpoint('v2/guild/{id}/treasury', auth=True,
+                               scopes=['account', 'guilds']),
+    'guild_upgrades': Endpoint('v2/guild/{id}/upgrades', auth=True,
+                               scopes=['account', 'guilds']),
+    'upgrades': Endpoint('v2/guild/upgrades', bulk=True, ttl=3600),
+    'achievements': Endpoint('v2/achievements', bulk=True, all=False,
+                             ttl=3600),
+    'achievement_categories': Endpoint('v2/achievements/categories',
+                                       bulk=True, ttl=3600),
+    'achievement_groups': Endpoint('v2/achievements/groups', bulk=True,
+                                   ttl=3600),
+    'colors': Endpoint('v2/colors', bulk=True, ttl=3600),
+    'continents': Endpoint('v2/continents', bulk=True, ttl=3600),
+    'continent_floor': Endpoint('v2/continents/{continent}/floors/{floor}',
+                                ttl=3600),
+    'currencies': Endpoint('v2/currencies', bulk=True, ttl=3600),
+    'files': Endpoint('v2/files', bulk=True, ttl=3600),
+    'items': Endpoint('v2/items', bulk=True, all=False, ttl=3600),
+    'maps': Endpoint('v2/maps', bulk=True, ttl=3600),
+    'material_categories': Endpoint('v2/materials', bulk=True, ttl=3600),
+    'quaggans': Endpoint('v2/quaggans', bulk=True, ttl=3600),
+    'recipes': Endpoint('v2/recipes', bulk=True, all=False, ttl=3600),
+    'skins': Endpoint('v2/skins', bulk=True, all=False, ttl=3600),
+    'worlds': Endpoint('v2/worlds', bulk=True, ttl=3600),
+}
 
-        Raises:
-            AuthorizationRequiredError: If the endpoint required
-                authorization, but none is provided.
-            APIError: If we have trouble contacting the endpoint, or the data
-                that comes back can't be converted properly.
-        """
-        api_url = f'{GW2APISession._base_url}/{url}'
-        if params:
-            params = urlencode(params, safe=',')
-            api_url = f'{api_url}?{params}'
-        api_data = data
-        api_headers = self._headers
-        if headers:
-            api_headers.update(headers)
-        self._log.debug(f'Requesting:\n'
-                        f'      URL: {api_url}\n'
-                        f'     Data: {api_data}\n'
-                        f'  Headers: {api_headers}')
-        req = Request(api_url, api_data, headers=api_headers)
-        try:
-            resp = urlopen(req)
-            return loads(resp.read())
-        except (HTTPError, URLError, JSONDecodeError) as e:
-            logging.exception(e)
-            raise APIError from e
 
-    def load_token(self, file_path):
+def endpoint_for(url):
+    """
+    Find the registered Endpoint a request URL is for. Exact paths win over
+    templates, so 'v2/guild/upgrades' isn't taken for a guild id.
+
+    Args:
+        url (str): Endpoint URL, as passed to make_request().
+
+    Returns (Endpoint):
+        The endpoint, or None if it isn't registered.
+    """
+    for endpoint in ENDPOINTS.values():
+        if not endpoint.templated and endpoint.path == url:
+            return endpoint
+    for endpoint in ENDPOINTS.values():
+        if endpoint.templated and endpoint.matches(url):
+            return endpoint
+    return None
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter. A single RateLimiter can be shared between any
+    number of sessions (and threads) to hold them all to one request budget.
+    """
+    def __init__(self, rate, burst=None):
         """
-        Load a token from a file.
+        Prepares a RateLimiter for use.
 
         Args:
-            file_path (str): Path to the file containing the token.
+            rate (float): Sustained number of requests allowed per second.
+            burst (int, optional): Number of requests that may be made back to
+                back before the sustained rate applies. Defaults to None,
+                which allows one second worth of requests.
         """
-        self._log.debug(f'Loading token from {file_path}')
-        with open(file_path, mode='r') as f:
-            self.token = f.read()
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, not {rate}')
+        self.rate = float(rate)
+        self.burst = burst if burst else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
 
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.rate:g}/s ' \
+               f'burst {self.burst}>'
 
-class GW2API(object):
-    """Parent class for an API endpoint. Other classes derive off of this."""
-    _endpoint_url = ''
-    _required_scopes = []
+    def _fill(self):
+        """Add the tokens accrued since the last call. Hold self._lock."""
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
 
-    def __init__(self, session=None):
+    def acquire(self, reserve=0, cost=1):
         """
-        Prepare a GW2API object for use.
+        Take request tokens, blocking until they are available.
 
         Args:
-            session (GW2APISession, optional): A session object. Defaults to
-                None, which results in a new session.
+            reserve (int, optional): Number of tokens that must be left for
+                other callers. Background callers pass this so they only use
+                spare capacity. Defaults to 0.
+            cost (int, optional): Number of tokens the request takes, from
+                its Endpoint. Capped at the burst. Defaults to 1.
+        """
+        cost = min(cost, self.burst)
+        reserve = min(reserve, self.burst - cost)
+        while True:
+            with self._lock:
+                self._fill()
+                if self._tokens >= cost + reserve:
+                    self._tokens -= cost
+                    return
+                wait = (cost + reserve - self._tokens) / self.rate
+            time.sleep(wait)
 
-        Raises:
-            TokenMissingScope: If the object requires a scope and the session
-                does not have a token with the appropriate scopes.
+    def try_acquire(self, reserve=0, cost=1):
         """
-        self._log.debug(
-            f'{self.__class__.__name__} init with session {session}'
-        )
-        self._session = session \
-            if isinstance(session, GW2APISession) \
-            else GW2APISession()
-        if self._required_scopes:
-            scopes = getattr(self._session.token_info, 'permissions', [])
-            if not all(s in scopes for s in scopes):
-                err = f'{self.__class__.__name__} is missing required ' \
-                      f'scopes.\n' \
-                      f'Need: {self._required_scopes}\n' \
-                      f'Have: {scopes}'
-                self._log.error(err)
-                raise TokenMissingScope(err)
+        Take request tokens if they are available right now.
 
-    @property
-    def _log(self):
-        """Logger"""
-        return logging.getLogger(f'GuildWars2API.{self.__class__.__name__}')
+        Args:
+            reserve (int, optional): Number of tokens that must be left for
+                other callers. Defaults to 0.
+            cost (int, optional): Number of tokens the request takes.
+                Defaults to 1.
+
+        Returns (bool):
+            Whether the tokens were taken.
+        """
+        cost = min(cost, self.burst)
+        reserve = min(reserve, self.burst - cost)
+        with self._lock:
+            self._fill()
+            if self._tokens >= cost + reserve:
+                self._tokens -= cost
+                return True
+            return False
 
 
-class GW2Thing(GW2API):
+@contextmanager
+def request_priority(priority):
     """
-    A class representing a single item (an Item, Recipe, Character,
-    etc). Properties are dynamically set based on the API return value.
+    Make requests in the current context (and pool threads started from it)
+    with the given RequestScheduler priority class.
 
-    Ensure the _endpoint_url class variable is set specific for the item.
+    Args:
+        priority (str): One of RequestScheduler.PRIORITIES.
+
+    Raises:
+        ValueError: If priority isn't a known priority class.
     """
-    def __init__(self, id=None, session=None):
+    if priority not in RequestScheduler.PRIORITIES:
+        raise ValueError(f'Unknown priority {priority!r}, expected one of '
+                         f'{RequestScheduler.PRIORITIES}')
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+class RequestScheduler(object):
+    """
+    Decides which waiting request goes next when requests are made faster
+    than they can be served. Requests are queued by priority class
+    (interactive, normal or bulk, set with request_priority()) and let
+    through with weighted fair queuing, so every class makes progress in
+    proportion to its weight, up to a limit on requests in flight overall and
+    optional caps per class. With the default weights a bulk sync gets what
+    is left over while interactive calls go nearly straight through.
+
+    A scheduler can be shared between sessions, and is best paired with a
+    RateLimiter: the scheduler orders requests, the limiter paces them.
+    """
+    PRIORITIES = ('interactive', 'normal', 'bulk')
+
+    def __init__(self, concurrency=8, weights=None, caps=None,
+                 window=1000):
         """
-        Prepares a GW2Thing for use.
+        Prepares a RequestScheduler for use.
 
         Args:
-            id (str, optional): An ID that the item corresponds to.
-            session (GW2APISession, optiona): Session to make requests from.
-                Defaults to None, which results in a new session. Session is
-                passed to child objects.
-            authentication? Defaults to False.
+            concurrency (int, optional): Most requests in flight at once.
+                Defaults to 8.
+            weights (dict, optional): Share of the capacity per priority
+                class. Defaults to None, which uses interactive 16, normal 4
+                and bulk 1.
+            caps (dict, optional): Most requests in flight at once per
+                priority class. Defaults to None, which caps bulk at half of
+                concurrency and leaves the others uncapped.
+            window (int, optional): Number of recent wait times kept per
+                class for metrics(). Defaults to 1000.
         """
-        super(GW2Thing, self).__init__(session=session)
-        if isinstance(id, dict):
-            self._update_obj(id)
-        else:
-            self.id = id
-            self.refresh()
-        self._log.info(f'Initialized {self}')
+        self.concurrency = concurrency
+        self.weights = {'interactive': 16, 'normal': 4, 'bulk': 1,
+                        **(weights or {})}
+        self.caps = {'bulk': max(1, concurrency // 2), **(caps or {})}
+        self._lock = threading.Lock()
+        self._queues = {p: [] for p in self.PRIORITIES}
+        self._active = dict.fromkeys(self.PRIORITIES, 0)
+        self._served = dict.fromkeys(self.PRIORITIES, 0)
+        self._finish = dict.fromkeys(self.PRIORITIES, 0.0)
+        self._waits = {p: [] for p in self.PRIORITIES}
+        self._window = window
+        self._clock = 0.0
+        self._seq = count()
 
     def __repr__(self):
-        """repr() output"""
-        item_name = self.__class__.__name__
-        item_desc = getattr(self, "name", getattr(self, "id", None))
-        return f'<{item_name} "{item_desc}">'
+        queued = sum(len(q) for q in self._queues.values())
+        active = sum(self._active.values())
+        return f'<{self.__class__.__name__} {active}/{self.concurrency} ' \
+               f'active, {queued} queued>'
 
-    def _update_obj(self, info):
+    @contextmanager
+    def slot(self, priority=None):
         """
-        Add the properties from a dictionary to the object, logging each one.
+        Wait for a turn to make a request, and hold it for the duration of
+        the with block.
 
         Args:
-            info (dict): Dictionary with the new values.
+            priority (str, optional): Priority class. Defaults to None, which
+                uses the one set with request_priority() (normal unless set).
+
+        Raises:
+            DeadlineExceeded: If the current Deadline passes while waiting.
         """
-        self._log.debug(f'Updating {self} with: {info}')
-        for k, v in info.items():
-            self._log.debug(f'Setting {self.__class__.__name__}.{k} to {v}')
-            self.__dict__[k] = v
-        self._log.debug(f'Updated {self}')
+        priority = priority or _PRIORITY.get()
+        if priority not in self._queues:
+            raise ValueError(f'Unknown priority {priority!r}')
+        queued = time.monotonic()
+        ticket = [None, next(self._seq), threading.Event()]
+        with self._lock:
+            # Virtual finish time: each class advances by 1/weight per request,
+            # starting no earlier than the current virtual clock.
+            start = max(self._clock, self._finish[priority])
+            ticket[0] = self._finish[priority] = \
+                start + 1.0 / self.weights[priority]
+            self._queues[priority].append(ticket)
+            self._dispatch()
+        deadline = _DEADLINE.get()
+        if not ticket[2].wait(None if deadline is None
+                              else deadline.remaining):
+            with self._lock:
+                if not ticket[2].is_set():
+                    self._queues[priority].remove(ticket)
+                    raise DeadlineExceeded(
+                        f'Deadline passed queued as {priority}')
+        self._record(priority, time.monotonic() - queued)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[priority] -= 1
+                self._served[priority] += 1
+                self._dispatch()
 
     @property
-    def details(self):
-        """Get a nice string representation of all properties on the object."""
-        return f'{repr(self)}\n' + \
-               '\n'.join([f'{k:>20}: {v}'
-                          for k, v in self.__dict__.items()
-                          if not callable(v) and not k.startswith('_')])
+    def saturated(self):
+        """Whether a new request would have to wait for a turn."""
+        with self._lock:
+            return any(self._queues.values()) or \
+                sum(self._active.values()) >= self.concurrency
 
-    def refresh(self):
-        params = {} if getattr(self, 'id', None) is None else {'id': self.id}
-        info = self._session.make_request(self._endpoint_url, params=params)
-        self._log.debug(f'Response:\n{pformat(info)}')
-        self._update_obj(info)
+    def _dispatch(self):
+        """Let queued requests through while there's room. Hold self._lock."""
+        while sum(self._active.values()) < self.concurrency:
+            ready = [p for p, q in self._queues.items() if q and
+                     self._active[p] < self.caps.get(p, self.concurrency)]
+            if not ready:
+                return
+            priority = min(ready, key=lambda p: self._queues[p][0][:2])
+            ticket = self._queues[priority].pop(0)
+            self._clock = max(self._clock,
+                              ticket[0] - 1.0 / self.weights[priority])
+            self._active[priority] += 1
+            ticket[2].set()
 
+    def _record(self, priority, waited):
+        """Keep a wait time for metrics()."""
+        with self._lock:
+            waits = self._waits[priority]
+            waits.append(waited)
+            if len(waits) > self._window:
+                del waits[:len(waits) - self._window]
 
-class GW2List(GW2API):
+    def metrics(self):
+        """
+        Get queue depths and wait times per priority class.
+
+        Returns (dict):
+            For each priority class, a dict with queued, active and served
+            request counts, and p50, p99 and max seconds spent waiting over
+            the recent window.
+        """
+        with self._lock:
+            stats = {}
+            for p in self.PRIORITIES:
+                waits = sorted(self._waits[p])
+
+                def pct(q):
+                    return waits[min(len(waits) - 1, int(q * len(waits)))] \
+                        if waits else 0.0
+                stats[p] = {
+                    'queued': len(self._queues[p]),
+                    'active': self._active[p],
+                    'served': self._served[p],
+                    'wait_p50': pct(0.5),
+                    'wait_p99': pct(0.99),
+                    'wait_max': waits[-1] if waits else 0.0,
+                }
+            return stats
+
+
+class _Timing(list):
     """
-    A class representing a list of things, either passed to the class,
-    or gleaned from an API. The class will be initialized with with the list
-    of ids or make a single request for the items.
+    Timing list for GW2APISession._fetch() that also sets an Event once the
+    request has been sent, or once the attempt is over if it never was.
+    """
+    def __init__(self):
+        super(_Timing, self).__init__()
+        self.sent = threading.Event()
 
-    Calling refresh() will cause the list to go make threaded API calls for
-    the individual items.
+    def append(self, mark):
+        super(_Timing, self).append(mark)
+        self.sent.set()
 
-    Ensure that the _endpoint_url and _thing_type are set for subclasses.
-    _thing_type should be a GW2Thing subclass.
+
+class RequestHedger(object):
     """
-    _thing_type = GW2Thing
-    _enum_type = None
+    Cuts tail latency on GETs by hedging: if a response hasn't arrived by the
+    time most responses from that endpoint have (its observed percentile
+    latency), the same request is sent again and whichever response arrives
+    first is used. urllib can't abort a request in flight, so the slower one
+    is left to finish on its pool thread and its response is dropped.
+    Latency is timed from when the request is sent to when its body has
+    arrived, so time spent queued in the scheduler or rate limiter doesn't
+    count, and the hedge threshold is likewise counted from when the first
+    request is sent.
 
-    def __init__(self, session=None, ids=None):
+    Hedges are limited to a fraction of requests, and are only sent if the
+    session's RateLimiter has a token to spare right away and its
+    RequestScheduler has a free slot, so hedging never makes requests wait
+    on either.
+    """
+    def __init__(self, percentile=0.95, budget=0.05, min_samples=20,
+                 window=200, max_workers=16):
         """
-        Prepares a GW2List for initial use.
+        Prepares a RequestHedger for use.
 
         Args:
-            session (GW2APISession, optional): Session to use to make requests.
-            ids (list or tuple, optional): List or tuple of Ids. Defaults to
-                None (which makes an API call).
+            percentile (float, optional): Latency percentile, per endpoint,
+                after which a hedge is sent. Defaults to 0.95.
+            budget (float, optional): Most hedges as a fraction of requests.
+                Defaults to 0.05.
+            min_samples (int, optional): Latencies to observe for an endpoint
+                before hedging its requests. Defaults to 20.
+            window (int, optional): Recent latencies kept per endpoint.
+                Defaults to 200.
+            max_workers (int, optional): Threads requests are run on.
+                Defaults to 16.
         """
-        super(GW2List, self).__init__(session=session)
-        self._things = None
-        self.count = 0
-        self._ids = ids if ids else self._session.make_request(
-            self._endpoint_url)
-        self._log.info(f'Initialized {self}')
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='GW2Hedge')
 
-    def __iter__(self):
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.hedges}/{self.requests} ' \
+               f'hedged, {self.wins} won>'
+
+    def threshold(self, key):
         """
-        Iterate over the items. Causes a refresh if it hasn't been previously.
+        Get the seconds after which requests for an endpoint are hedged.
+
+        Args:
+            key (str): Endpoint path.
+
+        Returns (float):
+            The threshold, or None if too few latencies have been observed.
         """
-        if self._things is None:
-            self.refresh()
-        return iter(self._things)
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if not latencies or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1,
+                           int(self.percentile * len(ordered)))]
 
-    def __repr__(self):
-        """repr() output"""
-        item_name = self._thing_type.__name__
-        items = f'{len(self._things)} {item_name} items' \
-            if self._things is not None \
-            else f'{len(self._ids)} {item_name} items' \
-            if self._ids is not None \
-            else f'?? {item_name} items'
-        return f'<{self.__class__.__name__} {items}>'
+    def _observe(self, key, seconds):
+        """Keep the latency of a completed request."""
+        with self._lock:
+            latencies = self._latencies.setdefault(key, [])
+            latencies.append(seconds)
+            if len(latencies) > self.window:
+                del latencies[:len(latencies) - self.window]
 
-    def refresh(self):
+    def _may_hedge(self, session, cost):
+        """Take budget for a hedge, if there is any to spare."""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            if session.rate_limiter is not None and \
+                    not session.rate_limiter.try_acquire(
+                        reserve=_RATE_RESERVE.get(), cost=cost):
+                return False
+            self.hedges += 1
+            return True
+
+    def fetch(self, session, url, params=None, headers=None):
         """
-        Go get all of the items and wrap them into their item classes. This
-        method uses a ThreadPool to make all of the API calls in parallel,
-        which uses a number of threads equal to the number of CPU cores.
+        Make a GET request through session, hedging it if it runs long.
+
+        Args:
+            session (GW2APISession): Session to make the request with.
+            url (str): Endpoint URL to call.
+            params (dict, optional): Parameters to add to the URL.
+            headers (dict, optional): Extra headers to send.
+
+        Returns (bytes):
+            The first response body to arrive.
+
+        Raises:
+            APIError: If every attempt fails.
+        """
+        endpoint = endpoint_for(url)
+        key = endpoint.path if endpoint is not None else url
+        with self._lock:
+            self.requests += 1
+        threshold = self.threshold(key)
+
+        def attempt(limited, timing):
+            try:
+                body = session._fetch(url, params, None, headers, limited,
+                                      timing)
+            finally:
+                timing.sent.set()
+            sent, received = timing
+            self._observe(key, received - sent)
+            return body
+
+        timing = _Timing()
+        primary = self._pool.submit(_propagating(attempt), True, timing)
+        if threshold is None:
+            return primary.result()
+        timing.sent.wait()
+        if not timing:
+            return primary.result()
+        done, _ = wait([primary], timeout=max(
+            0.0, timing[0] + threshold - time.monotonic()))
+        cost = endpoint.cost if endpoint is not None else 1
+        if done or (session.scheduler is not None and
+                    session.scheduler.saturated) or \
+                not self._may_hedge(session, cost):
+            return primary.result()
+        _annotate(hedged=True)
+        session._log.debug(f'Hedging {url} after {threshold:.3f}s')
+        hedge = self._pool.submit(_propagating(attempt), False, _Timing())
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.wins += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+        return primary.result()
+
+
+@functools.lru_cache(maxsize=64)
+def _token_digest(token, salt):
+    """
+    Hash a token for use in cache keys.
+
+    Args:
+        token (str): API key.
+        salt (bytes): The cache's salt, up to 64 bytes.
+
+    Returns (str):
+        Hex digest of the token, keyed with salt.
+    """
+    return hashlib.blake2b(token.encode('utf-8'), key=salt,
+                           digest_size=16).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    In-process cache of decoded responses. Entries expire after the TTL they
+    were stored with, and the least recently used entries are dropped once
+    max_entries is reached.
+
+    Keys of per-token responses hold a hash of the token, salted with the
+    cache's random salt, rather than the token itself.
+    """
+    def __init__(self, max_entries=50000):
+        """
+        Prepares a ResponseCache for use.
+
+        Args:
+            max_entries (int, optional): Most entries held at once. Defaults
+                to 50000.
+        """
+        self.max_entries = max_entries
+        self.salt = os.urandom(16)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)} entries>'
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, stale=False):
+        """
+        Get a cached value.
+
+        Args:
+            key (tuple): Cache key.
+            stale (bool, optional): Whether to return the value even if it
+                has expired. Expired entries are kept until they are evicted
+                or replaced, so they can be served when a fresh response
+                can't be had in time. Defaults to False.
+
+        Returns:
+            The value, or None if it isn't cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic() and not stale:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """
+        Cache a value.
+
+        Args:
+            key (tuple): Cache key.
+            value: Decoded response to cache.
+            ttl (float): Seconds until the value expires.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache(object):
+    """
+    Response cache shared by every process on a host, kept in a SQLite
+    database in WAL mode. Reads never wait on writers, so the read path is
+    as cheap as a local index lookup, and a response fetched by one worker
+    process is served to all of them.
+
+    Misses are single-flight across processes: the first process to miss a
+    key takes a lease on it and fetches it, and the others wait for the
+    response to land in the cache instead of fetching it too. Leases expire,
+    so a worker that dies mid-fetch doesn't hold the others up for long.
+
+    Drop-in for ResponseCache as GW2APISession's cache. Values must be JSON
+    serializable, as decoded responses are. The token hash salt is created
+    with the database and kept in it, so every process hashes tokens alike
+    and no token is written to the file.
+    """
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+        'expires REAL NOT NULL, value BLOB NOT NULL) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)',
+        'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, '
+        'expires REAL NOT NULL) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, '
+        'value BLOB NOT NULL) WITHOUT ROWID',
+    )
+
+    def __init__(self, path, max_entries=200000, lease=30.0,
+                 poll=0.02):
+        """
+        Prepares a SharedCache for use, creating the database if needed.
+
+        Args:
+            path (str): Database file. Every process sharing the cache must
+                use the same path, on a local filesystem.
+            max_entries (int, optional): Most entries kept. The entries
+                closest to expiring are dropped past this. Defaults to
+                200000.
+            lease (float, optional): Seconds a fetching process holds a key
+                for before others give up waiting and fetch it themselves.
+                Defaults to 30.
+            poll (float, optional): Seconds between checks while waiting on
+                another process's fetch. Defaults to 0.02.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.lease = lease
+        self.poll = poll
+        self._local = threading.local()
+        self._sets = count()
+        connection = self._connection
+        for statement in self._schema:
+            connection.execute(statement)
+        connection.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)',
+                           ('salt', os.urandom(16)))
+        self.salt = connection.execute(
+            'SELECT value FROM meta WHERE name = ?', ('salt',)).fetchone()[0]
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def _connection(self):
+        """This thread's connection; SQLite connections can't be shared."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _key(key):
+        """Serialize a cache key."""
+        return dumps(key, separators=(',', ':'))
+
+    def get(self, key, stale=False):
+        """
+        Get a cached value. See ResponseCache.get().
+        """
+        row = self._connection.execute(
+            'SELECT expires, value FROM entries WHERE key = ?',
+            (self._key(key),)).fetchone()
+        if row is None or (row[0] < time.time() and not stale):
+            return None
+        return loads(row[1])
+
+    def set(self, key, value, ttl):
+        """
+        Cache a value. See ResponseCache.set().
+        """
+        connection = self._connection
+        connection.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+            (self._key(key), time.time() + ttl,
+             dumps(value, separators=(',', ':')).encode('utf-8')))
+        if next(self._sets) % 1000 == 999:
+            self._prune(connection)
+
+    def _prune(self, connection):
+        """Drop the entries closest to expiring while over max_entries."""
+        excess = connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0] - self.max_entries
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+                'ORDER BY expires LIMIT ?)', (excess,))
+
+    def clear(self):
+        """Drop every entry."""
+        self._connection.execute('DELETE FROM entries')
+
+    def _take_lease(self, connection, key):
+        """Try to take the lease on a key, clearing it first if expired."""
+        now = time.time()
+        connection.execute('DELETE FROM leases WHERE key = ? AND expires < ?',
+                           (key, now))
+        try:
+            connection.execute('INSERT INTO leases VALUES (?, ?)',
+                               (key, now + self.lease))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    @contextmanager
+    def single_flight(self, key):
+        """
+        Coordinate fetching a missed key with other processes.
+
+        Args:
+            key (tuple): Cache key.
+
+        Yields (bool):
+            True if the caller should fetch and cache the key, or False if
+            another process just did, and the caller should read it from the
+            cache.
+        """
+        connection = self._connection
+        lease_key = self._key(key)
+        if self._take_lease(connection, lease_key):
+            try:
+                yield True
+            finally:
+                connection.execute('DELETE FROM leases WHERE key = ?',
+                                   (lease_key,))
+            return
+        MODULE_LOG.debug(f'Waiting on another process for {key}')
+        give_up = time.monotonic() + self.lease
+        deadline = _DEADLINE.get()
+        if deadline is not None:
+            give_up = min(give_up, deadline.expires)
+        while time.monotonic() < give_up:
+            time.sleep(self.poll)
+            if connection.execute('SELECT 1 FROM leases WHERE key = ?',
+                                  (lease_key,)).fetchone() is None:
+                yield False
+                return
+        yield True
+
+
+class IdentityMap(object):
+    """
+    Session-scoped map of (type, id) to the one object built for it, so the
+    same Item, Guild or World is only fetched and held once per session.
+    Objects are held by weak reference, so the map never keeps anything
+    alive on its own; max_strong keeps the most recently used objects alive
+    as well, for objects that are looked up often but not held anywhere.
+    """
+    def __init__(self, max_strong=0):
+        """
+        Prepares an IdentityMap for use.
+
+        Args:
+            max_strong (int, optional): Number of recently used objects to
+                hold strong references to. Defaults to 0.
+        """
+        self.max_strong = max_strong
+        self._weak = weakref.WeakValueDictionary()
+        self._strong = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)} objects>'
+
+    def __len__(self):
+        return len(self._weak)
+
+    def _touch(self, key, thing):
+        """Mark an object as recently used. Hold self._lock."""
+        if self.max_strong:
+            self._strong[key] = thing
+            self._strong.move_to_end(key)
+            while len(self._strong) > self.max_strong:
+                self._strong.popitem(last=False)
+
+    def get(self, key):
+        """
+        Get the object for a key.
+
+        Args:
+            key (tuple): (type, id) of the object.
+
+        Returns (GW2Thing):
+            The object, or None if there isn't a live one.
+        """
+        with self._lock:
+            thing = self._weak.get(key)
+            if thing is not None:
+                self._touch(key, thing)
+            return thing
+
+    def setdefault(self, key, thing):
+        """
+        Add an object, unless another thread got there first.
+
+        Args:
+            key (tuple): (type, id) of the object.
+            thing (GW2Thing): The object.
+
+        Returns (GW2Thing):
+            The object now held for the key.
+        """
+        with self._lock:
+            thing = self._weak.setdefault(key, thing)
+            self._touch(key, thing)
+            return thing
+
+    def clear(self):
+        """Forget every object."""
+        with self._lock:
+            self._weak.clear()
+            self._strong.clear()
+
+
+class JSONStream(object):
+    """
+    Incremental JSON parser over a binary file-like object, such as an open
+    response. Values are decoded one at a time as the data arrives, so only
+    the value being decoded (not the whole document) is held in memory, and
+    processing of early values overlaps with the download of later ones.
+    """
+    _until_bracket = re.compile(
+        r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*', re.S)
+    _number_end = re.compile(r'[\s,\]}]')
+    _whitespace = ' \t\r\n'
+
+    def __init__(self, fp, chunk_size=65536):
+        """
+        Prepares a JSONStream for use.
+
+        Args:
+            fp (file): Binary file-like object to read from.
+            chunk_size (int, optional): Bytes to read at a time. Defaults to
+                65536.
+        """
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._json = JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Read another chunk, dropping everything before self._pos.
+
+        Returns (bool):
+            False if the end of the data had already been reached.
+        """
+        if self._eof:
+            return False
+        data = self._fp.read(self._chunk_size)
+        self._eof = not data
+        self._buf = self._buf[self._pos:] + \
+            self._text.decode(data, final=self._eof)
+        self._pos = 0
+        return True
+
+    def _error(self, msg):
+        return JSONDecodeError(msg, self._buf, self._pos)
+
+    def _peek(self):
+        """
+        Skip whitespace.
+
+        Returns (str):
+            The next character, or '' at the end of the data.
+        """
+        while True:
+            while self._pos < len(self._buf) \
+                    and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        """Consume char, which must be the next non-whitespace character."""
+        if self._peek() != char:
+            raise self._error(f'Expecting {char!r}')
+        self._pos += 1
+
+    def _value(self):
+        """Decode the next value, reading more data until it is complete."""
+        if self._peek() in '-0123456789':
+            # A number is only complete once whatever follows it has arrived.
+            while self._number_end.search(self._buf, self._pos) is None \
+                    and self._fill():
+                pass
+        while True:
+            try:
+                value, self._pos = self._json.raw_decode(self._buf, self._pos)
+                return value
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def _skip(self):
+        """Step over the next value without decoding it."""
+        if self._peek() not in '[{':
+            self._value()
+            return
+        until_bracket = self._until_bracket.match
+        depth = 0
+        buf, pos = self._buf, self._pos
+        while True:
+            # Runs to the next bracket outside of a string, or to the opening
+            # quote of a string that hasn't fully arrived yet.
+            pos = until_bracket(buf, pos).end()
+            if pos == len(buf) or buf[pos] == '"':
+                self._pos = pos
+                if not self._fill():
+                    raise self._error('Unterminated value')
+                buf, pos = self._buf, self._pos
+                continue
+            depth += 1 if buf[pos] in '[{' else -1
+            pos += 1
+            if depth == 0:
+                self._pos = pos
+                return
+
+    def _members(self):
+        """
+        Step through the container at the current position.
+
+        Yields (str or int):
+            The key (or index) of each member, with the position left at the
+            member's value. The consumer must consume or skip the value
+            before asking for the next one.
+        """
+        opening = self._peek()
+        closing = ']' if opening == '[' else '}'
+        self._pos += 1
+        if self._peek() == closing:
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            if opening == '{':
+                key = self._value()
+                self._expect(':')
+            else:
+                key = index
+            yield key
+            index += 1
+            char = self._peek()
+            self._pos += 1
+            if char == closing:
+                return
+            if char != ',':
+                self._pos -= 1
+                raise self._error(f'Expecting \',\' or {closing!r}')
+
+    def items(self, path=()):
+        """
+        Yield the members of the container at path, decoding one at a time.
+
+        Args:
+            path (iterable, optional): Keys (for objects) or indexes (for
+                arrays) leading to the container, where '*' matches every
+                member. Defaults to (), the top level value.
+
+        Yields:
+            Each element of the array (or value of the object) at path.
+            Anything not on the path is skipped without being decoded.
+        """
+        yield from self._walk(tuple(path))
+
+    def _walk(self, path):
+        """Recursive worker for items()."""
+        if self._peek() not in '[{':
+            if path:
+                self._skip()
+            else:
+                yield self._value()
+            return
+        for key in self._members():
+            if not path:
+                yield self._value()
+            elif path[0] == '*' or path[0] == key:
+                yield from self._walk(path[1:])
+            else:
+                self._skip()
+
+
+class Deadline(object):
+    """
+    A time budget for a piece of work. While a Deadline is entered (as a
+    context manager), every request made in that context, including on pool
+    threads started from it, is bounded by the time remaining, and requests
+    that would start after it has passed raise DeadlineExceeded instead.
+    Objects that build sub-resources (Account, Character, GW2List) catch
+    that and come back partially hydrated, listing what is missing.
+    """
+    def __init__(self, seconds):
+        """
+        Prepares a Deadline for use.
+
+        Args:
+            seconds (float): Seconds from now until the deadline.
+        """
+        self.expires = time.monotonic() + seconds
+        self.stale = []
+        self._tokens = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.remaining:.3f}s left>'
+
+    def __enter__(self):
+        self._tokens.append(_DEADLINE.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _DEADLINE.reset(self._tokens.pop())
+
+    @property
+    def remaining(self):
+        """Seconds left until the deadline, never below 0."""
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        """Whether the deadline has passed."""
+        return time.monotonic() >= self.expires
+
+    def cancel(self):
+        """
+        Expire the deadline now, so no further requests are started under it.
+        """
+        self.expires = time.monotonic()
+
+    def check(self, what=''):
+        """
+        Raise if the deadline has passed.
+
+        Args:
+            what (str, optional): What was about to happen, for the message.
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed.
+        """
+        if self.expired:
+            raise DeadlineExceeded(f'Deadline passed before {what}')
+
+
+@contextmanager
+def _deadline_scope(deadline):
+    """
+    Enter a deadline given to a constructor, if one was given.
+
+    Args:
+        deadline (Deadline or float): A Deadline, seconds for a new one, or
+            None to carry on under the current one.
+
+    Yields (Deadline):
+        The deadline in force, or None.
+    """
+    if deadline is None:
+        yield _DEADLINE.get()
+        return
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    with deadline:
+        yield deadline
+
+
+class Span(object):
+    """A single timed piece of work recorded by a Tracer."""
+    def __init__(self, id, name, category, parent, args):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.args = args
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} ' \
+               f'{self.duration * 1000:.1f}ms>'
+
+    @property
+    def duration(self):
+        """Seconds the span took, or has taken so far."""
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Tracer(object):
+    """
+    Records nested Spans for object construction, refreshes and requests
+    made through a session (see GW2APISession.tracer), so the fan-out of a
+    build and its critical path can be inspected. Spans follow work onto
+    pool threads, and can be exported as Chrome trace-event JSON for
+    chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self.spans = []
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self.spans)} spans>'
+
+    @contextmanager
+    def span(self, name, category='', **args):
+        """
+        Context manager timing the work inside it as a Span, nested under
+        the current span.
+
+        Args:
+            name (str): Span name.
+            category (str, optional): Span category.
+            **args: Annotations to record on the span.
+
+        Yields (Span):
+            The span, which can be annotated further through its args.
+        """
+        parent = _CURRENT_SPAN.get()
+        span = Span(next(self._ids), name, category,
+                    parent.id if parent is not None else None, args)
+        token = _CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.args['error'] = repr(e)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _CURRENT_SPAN.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def clear(self):
+        """Drop every recorded span."""
+        with self._lock:
+            self.spans = []
+
+    def critical_path(self):
+        """
+        Find the chain of spans that bounded the longest root span: from the
+        root, repeatedly follow the child that finished last.
+
+        Returns (list):
+            Spans from the root down.
+        """
+        spans = [s for s in self.spans if s.end is not None]
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent, []).append(span)
+        if not children.get(None):
+            return []
+        path = [max(children[None], key=lambda s: s.duration)]
+        while children.get(path[-1].id):
+            path.append(max(children[path[-1].id], key=lambda s: s.end))
+        return path
+
+    def to_chrome(self):
+        """
+        Convert the spans to Chrome trace-event format.
+
+        Returns (dict):
+            A trace, ready to be serialized as JSON.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start - self._epoch) * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': pid,
+                'tid': span.thread,
+                'args': {'id': span.id, 'parent': span.parent,
+                         **{k: v if isinstance(v, (int, float, bool))
+                            else str(v)
+                            for k, v in span.args.items()}},
+            }
+            for span in self.spans
+        ]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        """
+        Write the spans to a Chrome trace-event JSON file.
+
+        Args:
+            path (str): File to write.
+        """
+        with open(path, mode='w') as f:
+            f.write(dumps(self.to_chrome()))
+        MODULE_LOG.info(f'Wrote {len(self.spans)} spans to {path}')
+
+
+class _HTTP2Response(object):
+    """
+    An httpx streaming response, made to look enough like the
+    http.client.HTTPResponse that urlopen() returns for the session's
+    readers.
+    """
+    def __init__(self, stream, response):
+        self._stream = stream
+        self._response = response
+        self._chunks = None
+        self._buffer = b''
+        self.status = response.status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stream.__exit__(*exc_info)
+
+    def read(self, amt=None):
+        """
+        Read up to amt bytes of the body, or all of it if amt is None.
+        """
+        try:
+            if amt is None or amt < 0:
+                if self._chunks is None:
+                    return self._response.read()
+                return self._buffer + b''.join(self._chunks)
+            if self._chunks is None:
+                self._chunks = self._response.iter_bytes()
+            while len(self._buffer) < amt:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer += chunk
+        except httpx.TimeoutException as e:
+            raise TimeoutError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise URLError(e) from e
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+
+class HTTP2Transport(object):
+    """
+    Sends a session's requests with httpx over HTTP/2, so that concurrent
+    requests (a GW2List fan-out, bulk pages on a thread pool) are
+    multiplexed over one connection instead of opening one each. Needs httpx
+    with HTTP/2 support (pip install httpx[http2]); GW2APISession falls back
+    to urllib if it isn't installed.
+
+    Errors are raised as the urllib errors the session already handles.
+    """
+    def __init__(self, max_connections=4, **client_options):
+        """
+        Prepares an HTTP2Transport for use.
+
+        Args:
+            max_connections (int, optional): Most connections per host.
+                Defaults to 4.
+            client_options: Passed on to httpx.Client, eg. verify, or
+                http1=False to talk HTTP/2 to a cleartext server.
+
+        Raises:
+            ImportError: If httpx or its HTTP/2 support isn't installed.
+        """
+        if httpx is None:
+            raise ImportError('HTTP/2 transport needs httpx[http2]')
+        self._client = httpx.Client(
+            http2=True, limits=httpx.Limits(max_connections=max_connections),
+            **client_options)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} HTTP/2>'
+
+    def open(self, req, timeout=None):
+        """
+        Send a request.
+
+        Args:
+            req (urllib.request.Request): The request, as built for urlopen.
+            timeout (float, optional): Seconds to wait on the request.
+
+        Returns (_HTTP2Response):
+            The open response. The caller is responsible for closing it.
+
+        Raises:
+            HTTPError: If the API responds with an error status.
+            URLError: If the request can't be sent.
+            TimeoutError: If the request times out.
+        """
+        stream = self._client.stream(
+            req.get_method(), req.full_url, content=req.data,
+            headers=dict(req.header_items()), timeout=timeout)
+        try:
+            response = stream.__enter__()
+        except httpx.TimeoutException as e:
+            raise TimeoutError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise URLError(e) from e
+        if response.status_code >= 400:
+            stream.__exit__(None, None, None)
+            raise HTTPError(req.full_url, response.status_code,
+                            response.reason_phrase, response.headers, None)
+        return _HTTP2Response(stream, response)
+
+    def close(self):
+        """Close the transport's connections."""
+        self._client.close()
+
+
+class GW2APISession(object):
+    """Session object. Keeps the token."""
+    _base_url = 'https://api.guildwars2.com'
+
+    def __init__(self, rate_limiter=None, timeout=None, cache=None,
+                 identity_map=True, tracer=None, scheduler=None,
+                 hedger=None, http2=False):
+        """
+        Prepares a session for use.
+
+        Args:
+            rate_limiter (RateLimiter, optional): Limiter every request made
+                through this session waits on. Defaults to None, which does
+                not limit requests.
+            timeout (float, optional): Seconds to wait on a single request
+                before giving up with an APIError. Defaults to None, which
+                waits indefinitely.
+            cache (ResponseCache or SharedCache, optional): Cache for
+                responses from endpoints with a ttl in ENDPOINTS. Defaults to
+                None, which doesn't cache.
+            identity_map (IdentityMap or bool, optional): Map that makes
+                identity mapped types (Item, Guild, World...) return the same
+                object for the same id. Defaults to True, which uses a new
+                weak-reference only IdentityMap. False disables it.
+            tracer (Tracer, optional): Tracer to record spans for work done
+                through this session. Defaults to None, which doesn't trace.
+            scheduler (RequestScheduler, optional): Scheduler every request
+                made through this session queues on, in the priority class
+                set with request_priority(). Defaults to None, which sends
+                requests in whatever order they're made.
+            hedger (RequestHedger, optional): Hedger for GET requests that
+                run long. Defaults to None, which doesn't hedge.
+            http2 (bool or HTTP2Transport, optional): Send requests over
+                HTTP/2, multiplexing concurrent requests over one connection.
+                True uses a new HTTP2Transport if httpx[http2] is installed,
+                and falls back to urllib with a warning if not. Defaults to
+                False.
+        """
+        self.__token = None
+        self.token_info = None
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.cache = cache
+        self.identity_map = IdentityMap() if identity_map is True \
+            else identity_map or None
+        self.tracer = tracer
+        self.scheduler = scheduler
+        self.hedger = hedger
+        self.transport = http2 if isinstance(http2, HTTP2Transport) else None
+        if http2 is True:
+            try:
+                self.transport = HTTP2Transport()
+            except ImportError as e:
+                self._log.warning(f'Using HTTP/1.1: {e}')
+        self._log.debug(f'Initialized {self}')
+
+    def __repr__(self):
+        state = 'Unauthenticated' \
+            if self.token_info is None \
+            else f'Authenticated with {str(self.token_info)}'
+        return f'<{self.__class__.__name__} {state}>'
+
+    @property
+    def token(self):
+        """Get the token value."""
+        return self.__token
+
+    @token.setter
+    def token(self, value):
+        """
+        Sets the token value, and makes an API call to get token info, storing
+        it in self.token_info.
+        """
+        self._log.debug(f'Setting token to {value}')
+        self.__token = value
+        self.token_info = Token(session=self)
+        self._log.debug(f'token_info updated with {self.token_info}')
+
+    @property
+    def _log(self):
+        """Logger"""
+        return logging.getLogger(f'GuildWars2API.{self.__class__.__name__}')
+
+    @property
+    def _headers(self):
+        """Get a dictionary of headers."""
+        if self.token:
+            return {'Authorization': f'Bearer {self.token}'}
+        return {}
+
+    def make_request(self, url, params=None, data=None, headers=None):
+        """
+        Make an API request.
+
+        Args:
+            url (str): Endpoint URL to call.
+            params (dict, optional): Parameters to add to the URL.
+            data (dict, optional): Data to send in the request payload.
+            headers (dict, optional): Headers to send on the request. Starts
+                with the self._headers, and updates that dictionary with these
+                values.
+
+        Returns (dict):
+            Dictionary converted from the JSON data returned.
+
+        Raises:
+            AuthorizationRequiredError: If the endpoint required
+                authorization, but none is provided.
+            APIError: If we have trouble contacting the endpoint, or the data
+                that comes back can't be converted properly.
+        """
+        if self.tracer is not None:
+            with self.tracer.span('make_request', 'request', url=url,
+                                  params=params):
+                return self._make_request(url, params, data, headers)
+        return self._make_request(url, params, data, headers)
+
+    def _make_request(self, url, params, data, headers):
+        """Worker for make_request()."""
+        endpoint = endpoint_for(url)
+        if endpoint is not None and endpoint.auth and not self.token:
+            err = f'{url} requires authorization, but no token is set.'
+            self._log.error(err)
+            raise AuthorizationRequiredError(err)
+        pages = self._all_pages(endpoint, url, params)
+        if pages is not None:
+            return [r for page in pages
+                    for r in self.make_request(url, params=page,
+                                               headers=headers)]
+        if self.cache is None or endpoint is None or not endpoint.ttl \
+                or data is not None:
+            return self._decode(self.make_raw_request(
+                url, params=params, data=data, headers=headers))
+        return self._cached_request(endpoint, url, params or {}, headers)
+
+    def stream_request(self, url, params=None, path=(), chunk_size=65536):
+        """
+        Make an API request and parse the response incrementally with a
+        JSONStream, yielding values as they arrive. Streamed responses are
+        never cached.
+
+        Args:
+            url (str): Endpoint URL to call.
+            params (dict, optional): Parameters to add to the URL.
+            path (iterable, optional): Path to the container whose members
+                are yielded. See JSONStream.items(). Defaults to (), the
+                top level array.
+            chunk_size (int, optional): Bytes to read at a time.
+
+        Yields:
+            Each member of the container at path.
+
+        Raises:
+            AuthorizationRequiredError: If the endpoint required
+                authorization, but none is provided.
+            APIError: If we have trouble contacting the endpoint, or the data
+                that comes back can't be parsed.
+        """
+        endpoint = endpoint_for(url)
+        if endpoint is not None and endpoint.auth and not self.token:
+            err = f'{url} requires authorization, but no token is set.'
+            self._log.error(err)
+            raise AuthorizationRequiredError(err)
+        pages = self._all_pages(endpoint, url, params)
+        if pages is not None:
+            for page in pages:
+                yield from self.stream_request(url, page, path, chunk_size)
+            return
+        try:
+            with self._open(url, params=params) as resp:
+                yield from JSONStream(resp, chunk_size).items(path)
+        except (HTTPError, URLError, TimeoutError, JSONDecodeError) as e:
+            logging.exception(e)
+            raise APIError from e
+
+    def _all_pages(self, endpoint, url, params):
+        """
+        Split an ids=all request into pages of ids, if the endpoint doesn't
+        accept ids=all (see Endpoint). The id list is fetched first.
+
+        Returns (list):
+            Request parameters for each page, or None if the request can be
+            made as it is.
+        """
+        if endpoint is None or not endpoint.bulk or endpoint.all \
+                or not params or params.get('ids') != 'all':
+            return None
+        rest = {k: v for k, v in params.items() if k != 'ids'}
+        ids = self.make_request(url, params=rest)
+        size = endpoint.page_size
+        return [{**rest, 'ids': ','.join(str(i) for i in ids[n:n + size])}
+                for n in range(0, len(ids), size)]
+
+    def _decode(self, body):
+        """
+        Decode a JSON response body.
+
+        Raises:
+            APIError: If the body isn't valid JSON.
+        """
+        try:
+            return loads(body)
+        except JSONDecodeError as e:
+            logging.exception(e)
+            raise APIError from e
+
+    def _cache_key(self, endpoint, url, params):
+        """
+        Build the cache key for a request. Responses that can't be shared
+        between tokens are keyed on a salted hash of the token as well, so
+        the token itself is never stored in the cache.
+        """
+        owner = None
+        if not endpoint.shared and self.token:
+            owner = _token_digest(self.token,
+                                  getattr(self.cache, 'salt', b''))
+        return (url,
+                tuple(sorted((k, str(v)) for k, v in params.items())),
+                owner)
+
+    def _cached_request(self, endpoint, url, params, headers):
+        """
+        Serve a request from self.cache where possible. Bulk requests only
+        fetch the ids that aren't already cached, and every record in a bulk
+        response is cached under its single id as well, so later single and
+        bulk lookups of the same ids are served without a request.
+
+        Args:
+            endpoint (Endpoint): The endpoint the request is for.
+            url (str): Endpoint URL.
+            params (dict): Request parameters.
+            headers (dict): Extra request headers.
+
+        Returns:
+            The decoded response.
+        """
+        ids = params.get('ids')
+        if endpoint.bulk and ids and ids != 'all':
+            rest = {k: v for k, v in params.items() if k != 'ids'}
+            wanted = str(ids).split(',')
+            found = {}
+            missing = self._from_cache(endpoint, url, rest, wanted, found)
+            self._log.debug(f'{len(found)} of {len(wanted)} ids cached')
+            _annotate(cached_ids=len(found), fetched_ids=len(missing))
+            if missing:
+                flight = self._cache_key(
+                    endpoint, url, {**rest, 'ids': ','.join(missing)})
+                with self._single_flight(flight) as leader:
+                    if not leader:
+                        missing = self._from_cache(
+                            endpoint, url, rest, missing, found)
+                    if missing:
+                        self._fetch_missing(
+                            endpoint, url, rest, missing, found, headers)
+            return [found[i] for i in wanted if i in found]
+        key = self._cache_key(endpoint, url, params)
+        hit = self.cache.get(key)
+        _annotate(cache='miss' if hit is None else 'hit')
+        if hit is not None:
+            return hit
+        with self._single_flight(key) as leader:
+            if not leader:
+                hit = self.cache.get(key)
+                if hit is not None:
+                    return hit
+            try:
+                value = self._decode(self.make_raw_request(
+                    url, params=params, headers=headers))
+            except DeadlineExceeded:
+                value = self.cache.get(key, stale=True)
+                if value is None:
+                    raise
+                self._log.warning(f'Serving stale {url} past the deadline')
+                _DEADLINE.get().stale.append(url)
+                return value
+            self.cache.set(key, value, endpoint.ttl)
+        if endpoint.bulk and ids:
+            self._cache_records(
+                endpoint, url,
+                {k: v for k, v in params.items() if k != 'ids'}, value)
+        return value
+
+    def _single_flight(self, key):
+        """
+        Single-flight context for a missed key, if the cache coordinates
+        fetches (see SharedCache.single_flight()). Otherwise every caller
+        fetches.
+        """
+        flight = getattr(self.cache, 'single_flight', None)
+        return nullcontext(True) if flight is None else flight(key)
+
+    def _from_cache(self, endpoint, url, params, ids, found):
+        """
+        Look up the single id entries for a bulk request.
+
+        Args:
+            endpoint (Endpoint): The endpoint the request is for.
+            url (str): Endpoint URL.
+            params (dict): Request parameters, other than ids.
+            ids (list): Ids (as strings) to look up.
+            found (dict): Id to record, updated with the hits.
+
+        Returns (list):
+            The ids that weren't cached.
+        """
+        missing = []
+        for i in ids:
+            hit = self.cache.get(
+                self._cache_key(endpoint, url, {**params, 'id': i}))
+            if hit is None:
+                missing.append(i)
+            else:
+                found[i] = hit
+        return missing
+
+    def _fetch_missing(self, endpoint, url, params, missing, found, headers):
+        """
+        Fetch the ids of a bulk request that weren't cached, and cache them.
+        Falls back to stale entries if the current Deadline passes.
+
+        Args:
+            endpoint (Endpoint): The endpoint the request is for.
+            url (str): Endpoint URL.
+            params (dict): Request parameters, other than ids.
+            missing (list): Ids (as strings) to fetch.
+            found (dict): Id to record, updated with what was fetched.
+            headers (dict): Extra request headers.
+        """
+        try:
+            fetched = self._decode(self.make_raw_request(
+                url, params={**params, 'ids': ','.join(missing)},
+                headers=headers))
+        except DeadlineExceeded:
+            fetched = [
+                r for r in (
+                    self.cache.get(self._cache_key(
+                        endpoint, url, {**params, 'id': i}), stale=True)
+                    for i in missing)
+                if r is not None
+            ]
+            if not found and not fetched:
+                raise
+            _DEADLINE.get().stale.append(url)
+        else:
+            self._cache_records(endpoint, url, params, fetched)
+        found.update((str(r.get('id')), r) for r in fetched)
+
+    def _cache_records(self, endpoint, url, params, records):
+        """Cache each record of a bulk response under its single id."""
+        for record in records:
+            if isinstance(record, dict) and 'id' in record:
+                self.cache.set(
+                    self._cache_key(endpoint, url,
+                                    {**params, 'id': record['id']}),
+                    record, endpoint.ttl)
+
+    def make_raw_request(self, url, params=None, data=None, headers=None):
+        """
+        Make an API request, returning the undecoded response body. Takes the
+        same arguments as make_request().
+
+        Returns (bytes):
+            The response body.
+
+        Raises:
+            APIError: If we have trouble contacting the endpoint.
+        """
+        if self.hedger is not None and data is None:
+            return self.hedger.fetch(self, url, params=params,
+                                     headers=headers)
+        return self._fetch(url, params, data, headers)
+
+    def _fetch(self, url, params, data, headers, limited=True,
+               timing=None):
+        """
+        Worker for make_raw_request(). See _open() for limited and timing;
+        the time the body finished arriving is appended to timing as well.
+        """
+        try:
+            with self._open(url, params=params, data=data, headers=headers,
+                            limited=limited, timing=timing) as resp:
+                body = resp.read()
+                if timing is not None:
+                    timing.append(time.monotonic())
+                _annotate(status=resp.status, bytes=len(body))
+                return body
+        except (HTTPError, URLError, TimeoutError) as e:
+            deadline = _DEADLINE.get()
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded(f'Deadline passed during {url}') \
+                    from e
+            logging.exception(e)
+            raise APIError from e
+
+    @contextmanager
+    def _open(self, url, params=None, data=None, headers=None,
+              limited=True, timing=None):
+        """
+        Build the request, wait for a turn from the scheduler and the rate
+        limiter and open the response. Takes the same arguments as
+        make_request(), and limited=False to skip the rate limiter for
+        requests that have already taken a token. If timing is a list, the
+        time.monotonic() the request is sent at, after those waits, is
+        appended to it.
+
+        Yields (http.client.HTTPResponse):
+            The open response, closed (and the scheduler slot given back) at
+            the end of the with block.
+        """
+        if self.scheduler is None:
+            with self._urlopen(url, params, data, headers, limited,
+                               timing) as resp:
+                yield resp
+            return
+        with self.scheduler.slot():
+            with self._urlopen(url, params, data, headers, limited,
+                               timing) as resp:
+                yield resp
+
+    def _urlopen(self, url, params, data, headers, limited, timing=None):
+        """Build the request, wait on the rate limiter and open it."""
+        api_url = f'{self._base_url}/{url}'
+        if params:
+            params = urlencode(params, safe=',')
+            api_url = f'{api_url}?{params}'
+        api_data = data
+        api_headers = self._headers
+        if headers:
+            api_headers.update(headers)
+        self._log.debug(f'Requesting:\n'
+                        f'      URL: {api_url}\n'
+                        f'     Data: {api_data}\n'
+                        f'  Headers: {api_headers}')
+        req = Request(api_url, api_data, headers=api_headers)
+        if self.rate_limiter is not None and limited:
+            endpoint = endpoint_for(url)
+            self.rate_limiter.acquire(
+                reserve=_RATE_RESERVE.get(),
+                cost=endpoint.cost if endpoint is not None else 1)
+        timeout = self.timeout
+        deadline = _DEADLINE.get()
+        if deadline is not None:
+            deadline.check(url)
+            timeout = deadline.remaining if timeout is None \
+                else min(timeout, deadline.remaining)
+        if timing is not None:
+            timing.append(time.monotonic())
+        if self.transport is not None:
+            return self.transport.open(req, timeout=timeout)
+        return urlopen(req, timeout=timeout)
+
+    def close(self):
+        """Close the session's HTTP/2 connections, if it has any."""
+        if self.transport is not None:
+            self.transport.close()
+
+    def load_token(self, file_path):
+        """
+        Load a token from a file.
+
+        Args:
+            file_path (str): Path to the file containing the token.
+        """
+        self._log.debug(f'Loading token from {file_path}')
+        with open(file_path, mode='r') as f:
+            self.token = f.read()
+
+
+def _shape(record, fields):
+    """
+    Put a raw record in the shape asked for by the get_raw()/iter_raw() APIs.
+
+    Args:
+        record (dict): Decoded record.
+        fields (list): Field names for a fixed tuple schema, or None to keep
+            the record as it is. Missing fields are None.
+
+    Returns (dict or tuple):
+        The record, or a tuple of its values for fields.
+    """
+    if fields is None or not isinstance(record, dict):
+        return record
+    return tuple(record.get(f) for f in fields)
+
+
+class GW2API(object):
+    """
+    Parent class for an API endpoint. Other classes derive off of this.
+
+    What an endpoint needs (scopes, batching, caching) is looked up in
+    ENDPOINTS by _endpoint_url.
+    """
+    _endpoint_url = ''
+
+    def __init__(self, session=None):
+        """
+        Prepare a GW2API object for use.
+
+        Args:
+            session (GW2APISession, optional): A session object. Defaults to
+                None, which results in a new session.
+
+        Raises:
+            AuthorizationRequiredError: If the object requires a scope and
+                the session does not have a token.
+            TokenMissingScope: If the object requires a scope and the session
+                does not have a token with the appropriate scopes.
+        """
+        log = self._log
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'{self.__class__.__name__} init with session {session}')
+        self._session = session \
+            if isinstance(session, GW2APISession) \
+            else GW2APISession()
+        if self._required_scopes:
+            if self._session.token_info is None:
+                err = f'{self.__class__.__name__} requires authorization, ' \
+                      f'but the session has no token.'
+                self._log.error(err)
+                raise AuthorizationRequiredError(err)
+            scopes = getattr(self._session.token_info, 'permissions', [])
+            if not all(s in scopes for s in self._required_scopes):
+                err = f'{self.__class__.__name__} is missing required ' \
+                      f'scopes.\n' \
+                      f'Need: {self._required_scopes}\n' \
+                      f'Have: {scopes}'
+                self._log.error(err)
+                raise TokenMissingScope(err)
+
+    @property
+    def _log(self):
+        """Logger"""
+        return logging.getLogger(f'GuildWars2API.{self.__class__.__name__}')
+
+    def _or_missing(self, name, build):
+        """
+        Build a sub-resource, recording it in self.missing instead if the
+        current Deadline passes first.
+
+        Args:
+            name (str): Attribute name of the sub-resource.
+            build (callable): Builds the sub-resource.
+
+        Returns:
+            The sub-resource, or None if it is missing.
+        """
+        try:
+            return build()
+        except DeadlineExceeded as e:
+            self._log.warning(f'{self} is missing {name}: {e}')
+            self.missing.append(name)
+            return None
+
+    def _build(self, builders):
+        """
+        Build independent sub-resources concurrently, and set each as an
+        attribute. Like _or_missing(), any that miss the current Deadline are
+        left as None and named in self.missing.
+
+        The graph runs on threads of its own rather than a shared executor,
+        so a build started from a task on some executor never waits on that
+        executor's workers.
+
+        Args:
+            builders (dict): Attribute name to a callable that builds it.
+        """
+        built = _run_graph(
+            {name: ((), lambda _, name=name, build=build:
+                    self._or_missing(name, build))
+             for name, build in builders.items()})
+        self.__dict__.update(built)
+
+    @property
+    def _endpoint(self):
+        """The registered Endpoint for _endpoint_url, or None."""
+        return endpoint_for(self._endpoint_url)
+
+    @property
+    def _required_scopes(self):
+        """Token scopes the endpoint needs, from ENDPOINTS."""
+        endpoint = self._endpoint
+        return list(endpoint.scopes) if endpoint is not None else []
+
+
+class GW2ThingType(type):
+    """
+    Metaclass for GW2Thing, routing construction through the session's
+    IdentityMap.
+
+    Classes that set _identity_mapped = True are identity mapped: building
+    one for an id the session already holds returns the held object (updated
+    with the new values if built from a record). Subclasses that don't set
+    _identity_mapped themselves, such as the per-slot EquippedItem, get a new
+    object per call, hydrated from their identity mapped ancestor's object so
+    the shared data is only fetched once.
+    """
+    def __init__(cls, name, bases, namespace):
+        super(GW2ThingType, cls).__init__(name, bases, namespace)
+        if namespace.get('_identity_mapped'):
+            cls._identity_base = cls
+        elif '_identity_mapped' in namespace:
+            cls._identity_base = None
+
+    def __call__(cls, *args, **kwargs):
+        session = kwargs.get('session')
+        if session is None:
+            session = next((a for a in args
+                            if isinstance(a, GW2APISession)), None)
+        tracer = getattr(session, 'tracer', None)
+        if tracer is None:
+            return cls._construct(session, args, kwargs)
+        id = args[0] if args and args[0] is not session else kwargs.get('id')
+        if isinstance(id, dict):
+            id = id.get('id')
+        with tracer.span(f'{cls.__name__}()', 'construct', id=id):
+            return cls._construct(session, args, kwargs)
+
+    def _construct(cls, session, args, kwargs):
+        """Build (or find) the object, through the IdentityMap if mapped."""
+        base = cls._identity_base
+        id = args[0] if args and args[0] is not session else kwargs.get('id')
+        identity_map = getattr(session, 'identity_map', None)
+        record = id if isinstance(id, dict) else None
+        key_id = record.get('id') if record is not None else id
+        if base is None or identity_map is None \
+                or not isinstance(key_id, (int, str)):
+            return super(GW2ThingType, cls).__call__(*args, **kwargs)
+        if base is not cls:
+            if record is not None:
+                return super(GW2ThingType, cls).__call__(*args, **kwargs)
+            shared = base(key_id, session=session)
+            thing = cls._from_record(shared._as_record(), session)
+            # Keeps the shared object alive for as long as this one is.
+            thing._shared = shared
+            return thing
+        key = (cls, key_id)
+        thing = identity_map.get(key)
+        if thing is not None:
+            if record is not None:
+                thing._update_obj(record)
+            return thing
+        thing = super(GW2ThingType, cls).__call__(*args, **kwargs)
+        return identity_map.setdefault(key, thing)
+
+
+class GW2Thing(GW2API, metaclass=GW2ThingType):
+    """
+    A class representing a single item (an Item, Recipe, Character,
+    etc). Properties are dynamically set based on the API return value.
+
+    Ensure the _endpoint_url class variable is set specific for the item.
+    Set _identity_mapped for types that are the same for every holder, so
+    that GW2ThingType shares them through the session's IdentityMap.
+    """
+    _identity_mapped = False
+
+    def __init__(self, id=None, session=None):
+        """
+        Prepares a GW2Thing for use.
+
+        Args:
+            id (str, optional): An ID that the item corresponds to.
+            session (GW2APISession, optiona): Session to make requests from.
+                Defaults to None, which results in a new session. Session is
+                passed to child objects.
+            authentication? Defaults to False.
+        """
+        super(GW2Thing, self).__init__(session=session)
+        if isinstance(id, dict):
+            self._update_obj(id)
+        else:
+            self.id = id
+            self.refresh()
+        self._log.info(f'Initialized {self}')
+
+    def __repr__(self):
+        """repr() output"""
+        item_name = self.__class__.__name__
+        item_desc = getattr(self, "name", getattr(self, "id", None))
+        return f'<{item_name} "{item_desc}">'
+
+    @classmethod
+    def _from_record(cls, record, session):
+        """
+        Build an object straight from a decoded record, skipping the scope
+        checks and per-key logging of __init__. Used by bulk paths that have
+        already done those checks once for the whole batch.
+
+        Args:
+            record (dict): The decoded record.
+            session (GW2APISession): Session the object will use.
+
+        Returns (GW2Thing):
+            The new object.
+        """
+        identity_map = getattr(session, 'identity_map', None)
+        key = (cls, record.get('id'))
+        if cls._identity_base is cls and identity_map is not None:
+            thing = identity_map.get(key)
+            if thing is not None:
+                thing.__dict__.update(record)
+                return thing
+        thing = cls.__new__(cls)
+        thing._session = session
+        thing.__dict__.update(record)
+        if cls._identity_base is cls and identity_map is not None \
+                and isinstance(key[1], (int, str)):
+            thing = identity_map.setdefault(key, thing)
+        return thing
+
+    @classmethod
+    def _request_for(cls, id):
+        """
+        Get the request that fetches a single object by id, for the raw
+        paths that don't build the object.
+
+        Args:
+            id: Id of the object.
+
+        Returns (tuple):
+            (url, params) to pass to make_request().
+        """
+        return cls._endpoint_url, {'id': id}
+
+    def _as_record(self):
+        """
+        Get the object's API values as a dictionary, as they would be in a
+        record from the API.
+
+        Returns (dict):
+            Every public property set on the object.
+        """
+        return {k: v for k, v in self.__dict__.items()
+                if not k.startswith('_')}
+
+    def _update_obj(self, info):
+        """
+        Add the properties from a dictionary to the object, logging each one.
+
+        Args:
+            info (dict): Dictionary with the new values.
+        """
+        log = self._log
+        if not log.isEnabledFor(logging.DEBUG):
+            self.__dict__.update(info)
+            return
+        log.debug(f'Updating {self} with: {info}')
+        for k, v in info.items():
+            log.debug(f'Setting {self.__class__.__name__}.{k} to {v}')
+            self.__dict__[k] = v
+        log.debug(f'Updated {self}')
+
+    @property
+    def details(self):
+        """Get a nice string representation of all properties on the object."""
+        return f'{repr(self)}\n' + \
+               '\n'.join([f'{k:>20}: {v}'
+                          for k, v in self.__dict__.items()
+                          if not callable(v) and not k.startswith('_')])
+
+    @_traced('refresh')
+    def refresh(self, raw=False, fields=None):
+        """
+        Re-fetch the object from the API.
+
+        Args:
+            raw (bool, optional): Return the record instead of updating the
+                object with it. Defaults to False.
+            fields (list, optional): With raw, return a tuple of these fields
+                instead of the record. See _shape().
+
+        Returns (dict or tuple):
+            The record, if raw.
+        """
+        params = {} if getattr(self, 'id', None) is None else {'id': self.id}
+        info = self._session.make_request(self._endpoint_url, params=params)
+        if raw:
+            return _shape(info, fields)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(f'Response:\n{pformat(info)}')
+        self._update_obj(info)
+
+
+class GW2List(GW2API):
+    """
+    A class representing a list of things, either passed to the class,
+    or gleaned from an API. The class will be initialized with with the list
+    of ids or make a single request for the items.
+
+    Calling refresh() will cause the list to go make threaded API calls for
+    the individual items.
+
+    Ensure that the _endpoint_url and _thing_type are set for subclasses.
+    _thing_type should be a GW2Thing subclass.
+    """
+    _thing_type = GW2Thing
+    _enum_type = None
+
+    def __init__(self, session=None, ids=None):
+        """
+        Prepares a GW2List for initial use.
+
+        Args:
+            session (GW2APISession, optional): Session to use to make requests.
+            ids (list or tuple, optional): List or tuple of Ids. Defaults to
+                None (which makes an API call).
+        """
+        super(GW2List, self).__init__(session=session)
+        self._things = None
+        self.count = 0
+        self.missing = []
+        self._ids = ids if ids is not None else self._session.make_request(
+            self._endpoint_url)
+        self._log.info(f'Initialized {self}')
+
+    def __iter__(self):
+        """
+        Iterate over the items. Causes a refresh if it hasn't been previously.
+        """
+        if self._things is None:
+            self.refresh()
+        return iter(self._things)
+
+    def __repr__(self):
+        """repr() output"""
+        item_name = self._thing_type.__name__
+        items = f'{len(self._things)} {item_name} items' \
+            if self._things is not None \
+            else f'{len(self._ids)} {item_name} items' \
+            if self._ids is not None \
+            else f'?? {item_name} items'
+        return f'<{self.__class__.__name__} {items}>'
+
+    @_traced('refresh')
+    def refresh(self, processes=None):
+        """
+        Go get all of the items and wrap them into their item classes. This
+        method uses a ThreadPool to make all of the API calls in parallel,
+        which uses a number of threads equal to the number of CPU cores.
+
+        Args:
+            processes (int or Executor, optional): Passed on to GW2Enum.get()
+                to decode pages on a process pool, for lists with an
+                _enum_type. Defaults to None.
+        """
+        self._log.info(f'Refreshing {self}')
+        self._log.debug(f'ID list to query:\n{pformat(self._ids)}')
+        timer = time.time()
+        wanted = [i.get('id') if isinstance(i, dict) else i
+                  for i in self._ids]
+        if self._enum_type:
+            try:
+                got_things = self._enum_type(session=self._session)\
+                    .get(wanted, processes=processes)
+            except DeadlineExceeded as e:
+                self._log.warning(f'Deadline passed refreshing {self}')
+                got_things = list(e.partial or [])
+            self._join(got_things)
+        else:
+            with ThreadPool(1) as pool:
+                got_things = pool.map(
+                    _propagating(self.get_thing),
+                    [(self._session, self._thing_type, t)
+                     for t in self._ids]
+                )
+            self._things = [t for t in got_things if t is not None]
+            got = {getattr(t, 'id', None) for t in self._things}
+            self.missing = [i for i in wanted
+                            if i is not None and i not in got]
+            self.count = len(self._things)
+        req_time = time.time() - timer
+        self._log.info(f'Found {self.count} items in {req_time:4.2f}s')
+
+    def _join(self, got_things):
+        """
+        Fill the list from things fetched for its ids. GW2Enum.get() returns
+        each id once, in no particular order, and leaves out ids it couldn't
+        find, so things are hash joined to the list's ids (and merged with
+        the list's records, if it holds records) rather than matched up by
+        position. Ids nothing was found for are listed in self.missing.
+
+        Args:
+            got_things (iterable): GW2Things of the list's _thing_type (or a
+                superclass, for records) for some or all of the list's ids.
+        """
+        by_id = {t.id: t for t in got_things}
+        things = []
+        self.missing = []
+        for orig in self._ids:
+            key = orig.get('id') if isinstance(orig, dict) else orig
+            if key is None:
+                continue
+            if key not in by_id:
+                self.missing.append(key)
+            elif isinstance(orig, dict):
+                things.append(self._thing_type._from_record(
+                    {**by_id[key]._as_record(), **orig}, self._session))
+            else:
+                things.append(by_id[key])
+        self._things = things
+        self.count = len(things)
+
+    def get_raw(self, fields=None):
+        """
+        Get the list's records as plain dictionaries (or tuples), without
+        building a GW2Thing for each. For pipelines that only pass the data
+        on.
+
+        Args:
+            fields (list, optional): Field names to return a tuple of per
+                record instead of the dictionary. See _shape().
+
+        Returns (list):
+            A record per item found, joined (by id) with the list's own
+            record for it when the list holds records, as refresh() does.
+        """
+        return list(self.iter_raw(fields=fields))
+
+    def iter_raw(self, fields=None):
+        """
+        Like get_raw(), yielding each record as it's ready.
+
+        Args:
+            fields (list, optional): See get_raw().
+
+        Yields (dict or tuple):
+            A record per item found.
+        """
+        wanted = [i.get('id') if isinstance(i, dict) else i
+                  for i in self._ids]
+        if self._enum_type:
+            by_id = {r.get('id'): r for r in self._enum_type(
+                session=self._session).get_raw(wanted)}
+            for orig in self._ids:
+                if isinstance(orig, dict):
+                    if orig.get('id') in by_id:
+                        yield _shape({**by_id[orig['id']], **orig}, fields)
+                elif orig in by_id:
+                    yield _shape(by_id[orig], fields)
+            return
+        request_for = self._thing_type._request_for
+        for orig in self._ids:
+            if isinstance(orig, dict) and orig.get('id'):
+                url, params = request_for(orig['id'])
+                yield _shape({**self._session.make_request(
+                    url, params=params), **orig}, fields)
+            elif isinstance(orig, str):
+                url, params = request_for(orig)
+                yield _shape(self._session.make_request(
+                    url, params=params), fields)
+
+    @staticmethod
+    def get_thing(args):
+        """
+        Static method called by the ThreadPool to make API calls and get
+        objects.
+
+        Args:
+            args (tuple): A 3 element tuple containing the session,
+                thing_type, and thing to get.
+
+        Returns (GWThing):
+            A GW2Thing object of thing_type type that represents the item, or
+            None if there isn't one or the current Deadline passed.
+        """
+        MODULE_LOG.debug(f'get_thing with: {args}')
+        session, thing_type, thing = args
+        try:
+            if isinstance(thing, dict) and thing.get('id'):
+                thing_obj = thing_type(thing.get('id'), session=session)
+                thing_obj._update_obj(thing)
+            elif isinstance(thing, str):
+                thing_obj = thing_type(thing, session=session)
+            else:
+                return None
+        except DeadlineExceeded as e:
+            MODULE_LOG.warning(f'Skipping {thing}: {e}')
+            return None
+        return thing_obj
+
+
+class GW2Enum(GW2API):
+    """
+    A class representing an Enumeration of types. Usually, these types allow
+    searching for specifics items based on criteria.
+
+    Ensure _thing_type is set in subclasses.
+    """
+    _thing_type = GW2Thing
+
+    def __init__(self, session=None):
+        """
+        Prepare a GW2Enum for use.
+
+        Args:
+            session (GW2APISession, optional): Session to use to make calls.
+                Defaults to None, which is replaced with a new session.
+        """
+        super(GW2Enum, self).__init__(session=session)
+        self._log.info(f'Initialized {self}')
+
+    def __repr__(self):
+        """repr() output."""
+        return f'<{self.__class__.__name__} of {self._thing_type.__name__}>'
+
+    @_traced('get')
+    def get(self, id=None, processes=None):
+        """
+        Get a specified item by id.
+
+        Args:
+            id (str or list, optional): ID to call for. Defaults to None,
+                which is replaced with 'all'.
+            processes (int or Executor, optional): Number of worker processes
+                (or a ProcessPoolExecutor to reuse) to decode pages with.
+                Defaults to None, which decodes in this process. See
+                _get_pages().
+
+        Returns (GW2Thing or list):
+            A GW2Thing of the type in self._thing_type with the object, or a
+            list of them if id was a list, tuple or 'all'. Lists of ids are
+            requested in pages of up to the endpoint's page_size ids, or one
+            at a time if the endpoint isn't registered as bulk.
+
+        Raises:
+            DeadlineExceeded: If the current Deadline passes. For lists, the
+                things fetched before it did are attached as partial.
+        """
+        endpoint = self._endpoint
+        if id is None:
+            id = 'all'
+        if endpoint is None or not endpoint.bulk:
+            if not any(isinstance(id, t) for t in (list, tuple)):
+                return self._thing_type(id, session=self._session)
+            things = []
+            try:
+                for i in id:
+                    things.append(self._thing_type(i, session=self._session))
+            except DeadlineExceeded as e:
+                e.partial = things
+                raise
+            return things
+        if id == 'all' and processes:
+            id = self._session.make_request(self._endpoint_url)
+        if id == 'all':
+            return [
+                self._thing_type(g, session=self._session)
+                for g in self._session.make_request(
+                    self._endpoint_url, params={'ids': 'all'}
+                )
+            ]
+        if any(isinstance(id, t) for t in (list, tuple)):
+            size = endpoint.page_size
+            pages = [
+                {'ids': ','.join([str(a) for a in id[i:i+size]])}
+                for i in range(0, len(id), size)
+            ]
+            if processes:
+                return self._get_pages(pages, processes)
+            things = []
+            try:
+                for params in pages:
+                    things.extend(
+                        self._thing_type(g, session=self._session)
+                        for g in self._session.make_request(
+                            self._endpoint_url, params=params
+                        )
+                    )
+            except DeadlineExceeded as e:
+                e.partial = things
+                raise
+            return things
+        else:
+            return self._thing_type(
+                self._session.make_request(self._endpoint_url, {'id': id}),
+                session=self._session,
+            )
+
+    def get_raw(self, id=None, fields=None):
+        """
+        Get records as plain dictionaries (or tuples), straight from the
+        decoder, without building a GW2Thing for each. Takes the same ids as
+        get(), and makes the same requests. Records may be shared with the
+        session's cache, so copy them before changing them.
+
+        Args:
+            id (str or list, optional): ID or IDs to call for. Defaults to
+                None, which is replaced with 'all'.
+            fields (list, optional): Field names to return a tuple of per
+                record instead of the dictionary. See _shape().
+
+        Returns (dict, tuple or list):
+            The record, or a list of them if id was a list, tuple or 'all'.
+        """
+        endpoint = self._endpoint
+        if id is None:
+            id = 'all'
+        many = id == 'all' or isinstance(id, (list, tuple))
+        request_for = self._thing_type._request_for
+        if not many:
+            url, params = request_for(id)
+            return _shape(self._session.make_request(url, params=params),
+                          fields)
+        if endpoint is None or not endpoint.bulk:
+            if id == 'all':
+                id = self._session.make_request(self._endpoint_url)
+            return [_shape(self._session.make_request(*request_for(i)),
+                           fields) for i in id]
+        if id == 'all':
+            pages = [{'ids': 'all'}]
+        else:
+            size = endpoint.page_size
+            pages = [{'ids': ','.join(str(a) for a in id[i:i + size])}
+                     for i in range(0, len(id), size)]
+        records = []
+        for params in pages:
+            page = self._session.make_request(self._endpoint_url,
+                                              params=params)
+            records.extend(page if fields is None
+                           else [_shape(r, fields) for r in page])
+        return records
+
+    def iter_raw(self, params=None, fields=None):
+        """
+        Stream the whole catalog like iter_all(), yielding plain records
+        (or tuples) instead of GW2Things.
+
+        Args:
+            params (dict, optional): Extra request parameters, eg. lang.
+            fields (list, optional): Field names to yield a tuple of per
+                record instead of the dictionary. See _shape().
+
+        Yields (dict or tuple):
+            Each record, as it arrives.
+        """
+        records = self._session.stream_request(
+            self._endpoint_url, params={**(params or {}), 'ids': 'all'})
+        if fields is None:
+            yield from records
+            return
+        for record in records:
+            yield _shape(record, fields)
+
+    def iter_all(self, params=None):
+        """
+        Stream the whole catalog from an ids=all request (or its pages, see
+        Endpoint), building each object as its record arrives instead of
+        after the whole response has been read.
+
+        Args:
+            params (dict, optional): Extra request parameters, eg. lang.
+
+        Yields (GW2Thing):
+            A GW2Thing of the type in self._thing_type for each record.
+        """
+        for record in self._session.stream_request(
+                self._endpoint_url, params={**(params or {}), 'ids': 'all'}):
+            yield self._thing_type(record, session=self._session)
+
+    def _get_pages(self, pages, processes):
+        """
+        Fetch pages on a thread per worker and hand each body to a process
+        pool to decode. Pages come back as compact (schemas, rows) tuples
+        and are reassembled in request order.
+
+        This does not scale with cores: this process still unpickles every
+        row, rebuilds every dictionary and builds every object, which costs
+        roughly 60% of a plain loads() of the same page. Expect at most a
+        1.5-2x speedup over decoding in this process, however many workers
+        are used; it mostly helps when fetching and decoding overlap.
+
+        Args:
+            pages (list): Request parameters for each page.
+            processes (int or Executor): Number of worker processes, or an
+                executor to reuse.
+
+        Returns (list):
+            GW2Things of self._thing_type, in page order.
+        """
+        timer = time.time()
+        owned = not isinstance(processes, Executor)
+        pool = ProcessPoolExecutor(processes) if owned else processes
+        workers = processes if owned else getattr(pool, '_max_workers', 4)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as fetchers:
+                bodies = fetchers.map(
+                    _propagating(lambda p: self._session.make_raw_request(
+                        self._endpoint_url, params=p)),
+                    pages
+                )
+                decoded = [pool.submit(_decode_records, b) for b in bodies]
+            things = []
+            for future in decoded:
+                try:
+                    schemas, rows = future.result()
+                except JSONDecodeError as e:
+                    logging.exception(e)
+                    raise APIError from e
+                things.extend(
+                    self._thing_type._from_record(
+                        dict(zip(schemas[s], values)), self._session)
+                    for s, values in rows
+                )
+        finally:
+            if owned:
+                pool.shutdown()
+        self._log.info(f'Decoded {len(things)} {self._thing_type.__name__} '
+                       f'in {len(pages)} pages in {time.time() - timer:4.2f}s')
+        return things
+
+    def write_snapshot(self, path, processes=None):
+        """
+        Fetch the whole catalog and write it to a CatalogSnapshot file.
+
+        Args:
+            path (str): File to write.
+            processes (int or Executor, optional): Passed on to get().
+
+        Returns (int):
+            Number of records written.
+        """
+        return CatalogSnapshot.write(path, self.get(processes=processes),
+                                     endpoint_url=self._endpoint_url)
+
+    def localized(self, languages=('en', 'de', 'fr', 'es'), id=None):
+        """
+        Fetch the catalog in several languages at once. See
+        LocalizedCatalog.
+
+        Args:
+            languages (iterable, optional): Language codes to fetch.
+                Defaults to en, de, fr and es.
+            id (list, optional): Ids to fetch. Defaults to None, which
+                fetches every id.
+
+        Returns (LocalizedCatalog):
+            The loaded catalog.
+        """
+        catalog = LocalizedCatalog(self, languages)
+        catalog.refresh(id)
+        return catalog
+
+    def open_snapshot(self, path):
+        """
+        Open a CatalogSnapshot file written by write_snapshot(), building
+        objects of this catalog's _thing_type on this session.
+
+        Args:
+            path (str): File to open.
+
+        Returns (CatalogSnapshot):
+            The open snapshot.
+        """
+        return CatalogSnapshot(path, thing_type=self._thing_type,
+                               session=self._session)
+
+
+class LocalizedCatalog(object):
+    """
+    A catalog fetched in several languages, keeping what doesn't change
+    between languages once. Every language is fetched concurrently, and
+    records are compared field by field, down into nested objects. Fields
+    whose values differ between languages for any record (name,
+    details.description...) are held per language in compact side tables
+    of value tuples; everything else is held once, in a shared record per
+    id. A record whose localized values are the same as the default
+    language's isn't held again for that language.
+
+    Localized fields are named by their dotted path, eg.
+    'details.description'.
+    """
+    def __init__(self, enum, languages=('en', 'de', 'fr', 'es')):
+        """
+        Prepares a LocalizedCatalog for use.
+
+        Args:
+            enum (GW2Enum): Catalog to fetch, with the session to use.
+            languages (iterable, optional): Language codes to fetch. The
+                first is the default locale. Defaults to en, de, fr and es.
+
+        Raises:
+            ValueError: If no languages are given.
+        """
+        self._enum = enum
+        self._session = enum._session
+        self.languages = tuple(languages)
+        if not self.languages:
+            raise ValueError('At least one language is needed')
+        self.default = self.languages[0]
+        self.fields = ()
+        self._paths = ()
+        self._shared = {}
+        self._localized = {lang: {} for lang in self.languages}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self._shared)} ' \
+               f'{self._enum._thing_type.__name__} records in ' \
+               f'{", ".join(self.languages)}>'
+
+    def __len__(self):
+        return len(self._shared)
+
+    def __contains__(self, id):
+        return id in self._shared
+
+    def __iter__(self):
+        return iter(self._shared)
+
+    def _fetch(self, lang, ids):
+        """Get every record in one language."""
+        session = self._session
+        url = self._enum._endpoint_url
+        if ids is None:
+            return session.make_request(url, params={'ids': 'all',
+                                                     'lang': lang})
+        size = self._enum._endpoint.page_size
+        records = []
+        for n in range(0, len(ids), size):
+            records.extend(session.make_request(url, params={
+                'ids': ','.join(str(i) for i in ids[n:n + size]),
+                'lang': lang}))
+        return records
+
+    @_traced('refresh')
+    def refresh(self, id=None):
+        """
+        Fetch the catalog in every language, and split it into the shared
+        records and per-language side tables.
+
+        Args:
+            id (list, optional): Ids to fetch. Defaults to None, which
+                fetches every id.
+        """
+        timer = time.time()
+        with ThreadPoolExecutor(max_workers=len(self.languages)) as pool:
+            fetched = dict(zip(self.languages, pool.map(
+                _propagating(lambda lang: self._fetch(lang, id)),
+                self.languages)))
+        by_lang = {lang: {r.get('id'): r for r in records}
+                   for lang, records in fetched.items()}
+        base = by_lang[self.default]
+        paths = set()
+        for lang, records in by_lang.items():
+            if lang == self.default:
+                continue
+            for record_id, record in records.items():
+                original = base.get(record_id)
+                if original is not None:
+                    paths.update(_differing_paths(original, record))
+        paths.discard(('id',))
+        paths = sorted(p for p in paths
+                       if not any(p[:n] in paths for n in range(1, len(p))))
+        self._paths = tuple(paths)
+        self.fields = tuple('.'.join(p) for p in paths)
+        shared = {}
+        for record_id, record in base.items():
+            for path in paths:
+                record = _drop_path(record, path)
+            shared[record_id] = record
+        self._shared = shared
+        default = {record_id: tuple(_pluck(record, p) for p in paths)
+                   for record_id, record in base.items()}
+        self._localized = {self.default: default}
+        for lang, records in by_lang.items():
+            if lang == self.default:
+                continue
+            table = self._localized[lang] = {}
+            for record_id, record in records.items():
+                original = default.get(record_id)
+                if original is None:
+                    continue
+                values = tuple(_pluck(record, p) for p in paths)
+                if values != original:
+                    table[record_id] = tuple(
+                        o if v == o else v for v, o in zip(values, original))
+        MODULE_LOG.info(f'Loaded {self} with localized fields '
+                        f'{self.fields} in {time.time() - timer:4.2f}s')
+
+    def get(self, id, locale=None):
+        """
+        Get a record in a language.
+
+        Args:
+            id: Record id.
+            locale (str, optional): Language code. Defaults to None, which
+                uses the default (first) language. Records missing from a
+                language fall back to the default language.
+
+        Returns (dict):
+            The record, or None if the id isn't in the catalog.
+
+        Raises:
+            ValueError: If locale isn't one of the catalog's languages.
+        """
+        locale = locale or self.default
+        if locale not in self._localized:
+            raise ValueError(f'{locale!r} is not one of {self.languages}')
+        record = self._shared.get(id)
+        if record is None:
+            return None
+        values = self._localized[locale].get(id) \
+            or self._localized[self.default][id]
+        record = dict(record)
+        for path, value in zip(self._paths, values):
+            if value is not _ABSENT:
+                record = _set_path(record, path, value)
+        return record
+
+    def text(self, id, field, locale=None):
+        """
+        Get a single localized field, without building the record.
+
+        Args:
+            id: Record id.
+            field (str): Field name, eg. 'name', or dotted path into a
+                nested object, eg. 'details.description'.
+            locale (str, optional): Language code, as for get().
+
+        Returns:
+            The value, or None if the record or field isn't present.
+        """
+        locale = locale or self.default
+        if locale not in self._localized:
+            raise ValueError(f'{locale!r} is not one of {self.languages}')
+        if field not in self.fields:
+            value = _pluck(self._shared.get(id, {}), tuple(field.split('.')))
+            return None if value is _ABSENT else value
+        values = self._localized[locale].get(id) \
+            or self._localized[self.default].get(id)
+        value = values[self.fields.index(field)] if values else None
+        return None if value is _ABSENT else value
+
+
+# Marks a localized field a record doesn't have, as opposed to one that is
+# present and null.
+_ABSENT = object()
+
+
+def _differing_paths(a, b, prefix=()):
+    """
+    Find where two records differ, descending into nested objects.
+
+    Args:
+        a (dict): A record.
+        b (dict): The same record in another language.
+        prefix (tuple, optional): Path of a and b in their records.
+
+    Yields (tuple):
+        The key path of each value that differs.
+    """
+    for key in a.keys() | b.keys():
+        x, y = a.get(key, _ABSENT), b.get(key, _ABSENT)
+        if isinstance(x, dict) and isinstance(y, dict):
+            yield from _differing_paths(x, y, prefix + (key,))
+        elif x != y:
+            yield prefix + (key,)
+
+
+def _pluck(record, path):
+    """Get the value at a key path, or _ABSENT if it isn't there."""
+    for key in path:
+        if not isinstance(record, dict) or key not in record:
+            return _ABSENT
+        record = record[key]
+    return record
+
+
+def _drop_path(record, path):
+    """Copy of a record without the value at a key path."""
+    head = path[0]
+    if head not in record:
+        return record
+    record = dict(record)
+    if len(path) == 1:
+        del record[head]
+    elif isinstance(record[head], dict):
+        record[head] = _drop_path(record[head], path[1:])
+    return record
+
+
+def _set_path(record, path, value):
+    """Copy of a record with the value at a key path set."""
+    head = path[0]
+    record = dict(record)
+    record[head] = value if len(path) == 1 \
+        else _set_path(record.get(head) or {}, path[1:], value)
+    return record
+
+
+def _decode_records(body):
+    """
+    Decode a response body into a compact, picklable form. Runs in the worker
+    processes of GW2Enum._get_pages().
+
+    Args:
+        body (bytes): JSON response body holding a record or list of records.
+
+    Returns (tuple):
+        A list of key tuples (one per distinct record shape), and a list of
+        (schema index, value tuple) rows in response order.
+    """
+    records = loads(body)
+    if isinstance(records, dict):
+        records = [records]
+    schemas, index, rows = [], {}, []
+    for record in records:
+        keys = tuple(record)
+        schema = index.get(keys)
+        if schema is None:
+            schema = index[keys] = len(schemas)
+            schemas.append(keys)
+        rows.append((schema, tuple(record.values())))
+    return schemas, rows
+
+
+class CatalogSnapshot(object):
+    """
+    A catalog written to a binary file and read back through mmap. Records
+    are stored as JSON, followed by an index of (id, offset, length) entries
+    sorted by id, so a single record can be found and decoded on demand
+    without loading the rest of the catalog. Every process that opens the
+    same file shares its pages through the OS page cache.
+
+    Layout (little endian):
+        header: magic, version, endpoint url length, record count, index
+            offset
+        endpoint url (utf-8)
+        records (JSON, utf-8)
+        index: count entries of (int64 id, uint64 offset, uint32 length)
+    """
+    _magic = b'GW2C'
+    _version = 1
+    _header = struct.Struct('<4sHHQQ')
+    _entry = struct.Struct('<qQI')
+
+    def __init__(self, path, thing_type=None, session=None):
+        """
+        Open a snapshot file for reading.
+
+        Args:
+            path (str): File written by CatalogSnapshot.write().
+            thing_type (type, optional): GW2Thing subclass to build from
+                records. Defaults to None, which builds plain GW2Things.
+            session (GW2APISession, optional): Session given to built objects.
+                Defaults to None, which results in a new session.
+
+        Raises:
+            ValueError: If the file isn't a snapshot this version can read.
+        """
+        self.path = path
+        self._thing_type = thing_type or GW2Thing
+        self._session = session \
+            if isinstance(session, GW2APISession) \
+            else GW2APISession()
+        with open(path, mode='rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, url_len, self._count, self._index = \
+            self._header.unpack_from(self._map, 0)
+        if magic != self._magic or version != self._version:
+            self._map.close()
+            raise ValueError(f'{path} is not a version {self._version} '
+                             f'catalog snapshot')
+        start = self._header.size
+        self.endpoint_url = self._map[start:start + url_len].decode('utf-8')
+        MODULE_LOG.info(f'Opened {self}')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path} ' \
+               f'{self._count} {self._thing_type.__name__} records>'
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, id):
+        return self._find(id) is not None
+
+    def __iter__(self):
+        """Iterate over the ids in the snapshot, in sorted order."""
+        for i in range(self._count):
+            yield self._entry_at(i)[0]
+
+    def __getitem__(self, id):
+        thing = self.get(id)
+        if thing is None:
+            raise KeyError(id)
+        return thing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the file."""
+        self._map.close()
+
+    def _entry_at(self, position):
+        """Get the (id, offset, length) index entry at a position."""
+        return self._entry.unpack_from(
+            self._map, self._index + position * self._entry.size)
+
+    def _find(self, id):
+        """
+        Binary search the index for an id.
+
+        Returns (tuple):
+            The (offset, length) of the record, or None if it isn't present.
+        """
+        if not isinstance(id, int):
+            try:
+                id = int(id)
+            except (TypeError, ValueError):
+                return None
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            found, offset, length = self._entry_at(middle)
+            if found == id:
+                return offset, length
+            if found < id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def record(self, id):
+        """
+        Decode a single record.
+
+        Args:
+            id (int): Id of the record.
+
+        Returns (dict):
+            The record, or None if it isn't in the snapshot.
+        """
+        found = self._find(id)
+        if found is None:
+            return None
+        offset, length = found
+        return loads(self._map[offset:offset + length])
+
+    def get(self, id):
+        """
+        Build an object from a single record.
+
+        Args:
+            id (int): Id of the record.
+
+        Returns (GW2Thing):
+            An object of the snapshot's thing type, or None if the id isn't in
+            the snapshot.
+        """
+        record = self.record(id)
+        if record is None:
+            return None
+        return self._thing_type._from_record(record, self._session)
+
+    @classmethod
+    def write(cls, path, records, endpoint_url=''):
+        """
+        Write records to a snapshot file. The file is written alongside and
+        moved into place once complete, so readers never see a partial file.
+
+        Args:
+            path (str): File to write.
+            records (iterable): GW2Things or dictionaries with integer ids.
+            endpoint_url (str, optional): Endpoint the records came from.
+
+        Returns (int):
+            Number of records written.
+
+        Raises:
+            ValueError: If a record doesn't have an integer id.
+        """
+        url = endpoint_url.encode('utf-8')
+        index = []
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, mode='wb') as f:
+            f.write(b'\0' * cls._header.size)
+            f.write(url)
+            offset = cls._header.size + len(url)
+            for record in records:
+                if not isinstance(record, dict):
+                    record = record._as_record()
+                id = record.get('id')
+                if not isinstance(id, int):
+                    raise ValueError(f'Snapshot records need integer ids, '
+                                     f'not {id!r}')
+                data = dumps(record, separators=(',', ':')).encode('utf-8')
+                f.write(data)
+                index.append((id, offset, len(data)))
+                offset += len(data)
+            index.sort()
+            for entry in index:
+                f.write(cls._entry.pack(*entry))
+            f.seek(0)
+            f.write(cls._header.pack(cls._magic, cls._version, len(url),
+                                     len(index), offset))
+        os.replace(tmp_path, path)
+        MODULE_LOG.info(f'Wrote {len(index)} records to {path}')
+        return len(index)
+
+
+class Token(GW2Thing):
+    """Token object"""
+    _endpoint_url = 'v2/tokeninfo'
+
+    def __repr__(self):
+        item_name = getattr(self, 'name', 'Unknown')
+        item_perms = getattr(self, 'permissions', [])
+        return f'<{self.__class__.__name__} "{item_name}" with scopes ' \
+               f'{", ".join(item_perms)}>'
+
+    def __str__(self):
+        item_name = getattr(self, 'name', 'Unknown')
+        item_perms = getattr(self, 'permissions', [])
+        return f'"{item_name}" with scopes {", ".join(item_perms)}'
+
+
+class Account(GW2Thing):
+    """
+    Account object
+
+    If a deadline is given (or one is in force), sub-resources that can't be
+    built before it passes are left as None and named in self.missing, and
+    the URLs of any responses served stale from the cache are listed in
+    self.stale.
+    """
+    _endpoint_url = 'v2/account'
+
+    def __init__(self, session=None, deadline=None):
+        with _deadline_scope(deadline) as deadline:
+            self.missing = []
+            super(Account, self).__init__(session=session)
+            session = self._session
+            world, guilds = self.world, self.guilds
+            # Everything below only needs v2/account, so build it all at once.
+            self._build({
+                'world': lambda: World(world, session=session),
+                'guilds': lambda: MyGuilds(ids=guilds, session=session),
+                'bank': lambda: Bank(session=session),
+                'characters': lambda: MyCharacters(session=session),
+                'achievements': lambda: MyAchievements(session=session),
+            })
+            self.stale = list(deadline.stale) if deadline else []
+        self._log.debug(f'Account initialized with {self.__dict__}')
+
+    @property
+    def partial(self):
+        """Whether any sub-resource is missing or stale."""
+        return bool(self.missing or self.stale)
+
+
+class Character(GW2Thing):
+    """
+    Character object
+
+    Like Account, sub-resources missed because of a deadline are left as
+    None and named in self.missing.
+    """
+    _endpoint_url = 'v2/characters'
+
+    def __init__(self, id, session=None, deadline=None):
+        with _deadline_scope(deadline):
+            self.missing = []
+            super(Character, self).__init__(id, session=session)
+            session = self._session
+            guild, recipes, equipment = \
+                self.guild, self.recipes, self.equipment
+            self._build({
+                'guild': lambda: Guild(guild, session=session),
+                'recipes': lambda: MyRecipes(ids=recipes, session=session),
+                'equipment': lambda: MyEquipment(ids=equipment,
+                                                 session=session),
+            })
+
+
+class MyCharacters(GW2List):
+    """
+    Collection of Characters for Account
+
+    refresh() gets every character in one ids=all request, then hydrates the
+    guilds, recipes and equipped items of all of them at once, fetching each
+    distinct id once and bulk endpoints a page at a time. That's a handful
+    of requests however many characters the account has, where building
+    each Character on its own takes several per character.
+    """
+    _endpoint_url = 'v2/characters'
+    _thing_type = Character
+
+    def _get_all(self, enum_type, ids):
+        """
+        Get things for ids, keeping what was fetched if the Deadline passes.
+
+        Returns (dict):
+            Id to thing, for every id found.
+        """
+        try:
+            things = enum_type(session=self._session).get(ids) if ids else []
+        except DeadlineExceeded as e:
+            self._log.warning(f'Deadline passed fetching '
+                              f'{enum_type.__name__}: {e}')
+            things = e.partial or []
+        return {t.id: t for t in things}
+
+    @_traced('refresh')
+    def refresh(self, processes=None):
+        """
+        Get every character and its guild, recipes and equipment in bulk.
+
+        Args:
+            processes: Unused; kept for compatibility with GW2List.refresh().
+        """
+        self._log.info(f'Refreshing {self}')
+        timer = time.time()
+        session = self._session
+        wanted = set(self._ids)
+        records = [r for r in session.make_request(
+            self._endpoint_url, params={'ids': 'all'})
+            if r.get('name') in wanted]
+        guilds = self._get_all(Guilds, sorted(
+            {r['guild'] for r in records if r.get('guild')}))
+        recipes = self._get_all(Recipes, sorted(
+            {i for r in records for i in r.get('recipes') or []}))
+        items = self._get_all(Items, sorted(
+            {e['id'] for r in records for e in r.get('equipment') or []
+             if e and e.get('id')}))
+        characters = []
+        for record in records:
+            character = Character._from_record(record, session)
+            character.id = record['name']
+            character.missing = []
+            guild_id = record.get('guild')
+            character.guild = guilds.get(guild_id)
+            if guild_id and character.guild is None:
+                character.missing.append('guild')
+            character.recipes = MyRecipes(
+                ids=record.get('recipes') or [], session=session)
+            character.recipes._join(recipes.values())
+            character.equipment = MyEquipment(
+                ids=record.get('equipment') or [], session=session)
+            character.equipment._join(items.values())
+            for name in ('recipes', 'equipment'):
+                if getattr(character, name).missing:
+                    character.missing.append(name)
+            characters.append(character)
+        got = {c.id for c in characters}
+        self.missing = [n for n in self._ids if n not in got]
+        self._things = characters
+        self.count = len(characters)
+        req_time = time.time() - timer
+        self._log.info(f'Found {self.count} items in {req_time:4.2f}s')
+
+
+class Guild(GW2Thing):
+    """Guild object"""
+    _endpoint_url = 'v2/guild'
+    _identity_mapped = True
+
+    def __init__(self, id, session=None):
+        self._endpoint_url = ENDPOINTS['guild'].url(id=id)
+        super(Guild, self).__init__(session=session)
+
+    @classmethod
+    def _request_for(cls, id):
+        """Guilds are fetched from their own path. See GW2Thing."""
+        return ENDPOINTS['guild'].url(id=id), None
+
+    def upgrades(self):
+        """
+        Get the upgrades the guild has unlocked. Requires a token of a guild
+        leader.
+
+        Returns (MyGuildUpgrades):
+            The guild's upgrades.
+        """
+        return MyGuildUpgrades(self.id, session=self._session)
+
+    def log(self, since=None):
+        """
+        Get the guild's log. Requires a token of a guild leader.
+
+        Args:
+            since (int, optional): Only get entries after this log entry id.
+                Defaults to None, which gets the latest 100 entries.
+
+        Returns (list):
+            Log entry records, newest first.
+        """
+        return self._session.make_request(
+            ENDPOINTS['guild_log'].url(id=self.id),
+            params=None if since is None else {'since': since})
+
+    def members(self):
+        """
+        Get the guild's members. Requires a token of a guild leader.
+
+        Returns (list):
+            Member records (name, rank, joined).
+        """
+        return self._session.make_request(
+            ENDPOINTS['guild_members'].url(id=self.id))
+
+    def stash(self):
+        """
+        Get the guild's stash. Requires a token of a guild leader.
+
+        Returns (list):
+            A record per stash (upgrade_id, size, coins, inventory).
+        """
+        return self._session.make_request(
+            ENDPOINTS['guild_stash'].url(id=self.id))
+
+    def treasury(self):
+        """
+        Get the guild's treasury. Requires a token of a guild leader.
+
+        Returns (list):
+            A record per item (item_id, count, needed_by).
+        """
+        return self._session.make_request(
+            ENDPOINTS['guild_treasury'].url(id=self.id))
+
+
+class Guilds(GW2Enum):
+    """Collection of Guilds"""
+    _endpoint_url = 'v2/guild'
+    _thing_type = Guild
+
+    def search(self, name):
+        """
+        Find guilds by exact name.
+
+        Args:
+            name (str): Guild name to search for.
+
+        Returns (list):
+            Guild objects for every match.
+        """
+        return self.get(self._session.make_request(
+            ENDPOINTS['guild_search'].path, params={'name': name}))
+
+
+class MyGuilds(GW2List):
+    """Collection of Guilds for Account"""
+    _thing_type = Guild
+
+
+class World(GW2Thing):
+    """World object"""
+    _endpoint_url = 'v2/worlds'
+    _identity_mapped = True
+    # Lookup tables from here: http://wiki.guildwars2.com/wiki/API:2/worlds
+    _regions = {'1': 'North America', '2': 'Europe'}
+    _languages = {'0': 'English', '1': 'French', '2': 'German',
+                  '3': 'Spanish'}
+
+    @property
+    def region(self):
+        """The region of the world, from the first digit of its id."""
+        return self._regions.get(str(self.id)[0:1], 'Unknown')
+
+    @property
+    def language(self):
+        """The language of the world, from the second digit of its id."""
+        return self._languages.get(str(self.id)[1:2], 'Unknown')
+
+
+class Worlds(GW2Enum):
+    """Collection of Worlds"""
+    _endpoint_url = 'v2/worlds'
+    _thing_type = World
+
+
+class Item(GW2Thing):
+    """Item object"""
+    _endpoint_url = 'v2/items'
+    _identity_mapped = True
+
+
+class Items(GW2Enum):
+    """Collection of items"""
+    _endpoint_url = 'v2/items'
+    _thing_type = Item
+
+
+class Recipe(GW2Thing):
+    """Recipe object"""
+    _endpoint_url = 'v2/recipes'
+    _identity_mapped = True
+
+
+class Recipes(GW2Enum):
+    """Collection of Recipes"""
+    _endpoint_url = 'v2/recipes'
+    _thing_type = Recipe
+
+
+class MyRecipes(GW2List):
+    """Collection of Recipes on a Character"""
+    _thing_type = Recipe
+    _enum_type = Recipes
+
+
+class RecipeGraph(object):
+    """
+    A graph of the Recipes catalog, indexed by output item id, with an edge
+    from every output to each of its ingredients. Costs are evaluated
+    against a price vector and memoized; changing a price only discards the
+    memoized costs of the items that (transitively) use it.
+
+    An item is never crafted from itself: an ingredient already being
+    evaluated further up is bought instead. The cost of an item that is
+    part of a recipe cycle depends on which item the evaluation started
+    from, so those are never memoized, and every result is the same
+    whatever order items are asked for in:
+
+    >>> graph = RecipeGraph([
+    ...     {'id': 1, 'output_item_id': 'A',
+    ...      'ingredients': [{'item_id': 'B', 'count': 1}]},
+    ...     {'id': 2, 'output_item_id': 'B', 'output_item_count': 2,
+    ...      'ingredients': [{'item_id': 'A', 'count': 1}]},
+    ... ], prices={'A': 10, 'B': 100})
+    >>> graph.cost('A'), graph.cost('B')
+    (5.0, 5.0)
+    >>> graph.cost('B'), graph.cost('A')
+    (5.0, 5.0)
+    >>> graph.set_prices({'A': 11})
+    >>> graph.cost('B'), graph.cost('A')
+    (5.5, 5.5)
+    """
+    def __init__(self, recipes, prices=None):
+        """
+        Prepares a RecipeGraph for use.
+
+        Args:
+            recipes (iterable): Recipe objects or recipe dictionaries, as
+                returned by Recipes.get().
+            prices (dict, optional): Item id to the price of buying one of
+                the item. Items without a price can only be crafted.
+        """
+        self._recipes = {}
+        self._used_by = {}
+        self._prices = {}
+        self._memo = {}
+        for recipe in recipes:
+            info = recipe if isinstance(recipe, dict) else recipe.__dict__
+            ingredients = tuple(
+                (i.get('item_id', i.get('id')), i.get('count', 1))
+                for i in info.get('ingredients', [])
+                if i.get('type', 'Item') == 'Item'
+            )
+            output = info['output_item_id']
+            self._recipes.setdefault(output, []).append(
+                (info.get('id'), info.get('output_item_count') or 1,
+                 ingredients)
+            )
+            for item_id, _ in ingredients:
+                self._used_by.setdefault(item_id, set()).add(output)
+        if prices:
+            self._prices.update(prices)
+        self._cyclic = self._find_cycles()
+        MODULE_LOG.info(f'Built {self}')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self._recipes)} ' \
+               f'craftable items>'
+
+    def __contains__(self, item_id):
+        return item_id in self._recipes
+
+    def _find_cycles(self):
+        """
+        Find every item that is part of a recipe cycle, with an iterative
+        Tarjan's strongly connected components pass over the graph.
+
+        Returns (set):
+            Ids of the items in a cycle, including items made from
+            themselves.
+        """
+        edges = {item_id: [i for _, _, ingredients in recipes
+                           for i, _ in ingredients]
+                 for item_id, recipes in self._recipes.items()}
+        index, low, stack, on_stack, cyclic = {}, {}, [], set(), set()
+        for root in edges:
+            if root in index:
+                continue
+            work = [(root, iter(edges[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(edges.get(child, ()))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in edges.get(node, ()):
+                            cyclic.update(component)
+        return cyclic
+
+    @classmethod
+    def from_session(cls, session=None, prices=None):
+        """
+        Build a RecipeGraph from the full Recipes catalog.
+
+        Args:
+            session (GW2APISession, optional): Session to make requests from.
+            prices (dict, optional): Initial price vector.
+
+        Returns (RecipeGraph):
+            The graph of every recipe in the game.
+        """
+        return cls(Recipes(session=session).get(), prices=prices)
+
+    @property
+    def craftable(self):
+        """Ids of every item that at least one recipe outputs."""
+        return self._recipes.keys()
+
+    def set_prices(self, prices):
+        """
+        Update the price vector, discarding the memoized costs of only the
+        items whose cost can depend on a changed price.
+
+        Args:
+            prices (dict): Item id to new price. A price of None removes it.
+        """
+        changed = []
+        for item_id, price in prices.items():
+            if self._prices.get(item_id) != price:
+                changed.append(item_id)
+                if price is None:
+                    self._prices.pop(item_id, None)
+                else:
+                    self._prices[item_id] = price
+        stale = set()
+        while changed:
+            item_id = changed.pop()
+            if item_id in stale:
+                continue
+            stale.add(item_id)
+            changed.extend(self._used_by.get(item_id, ()))
+        for item_id in stale:
+            self._memo.pop(item_id, None)
+        MODULE_LOG.debug(f'Price update invalidated {len(stale)} items')
+
+    def _evaluate(self, item_id, visiting):
+        """
+        Work out the cheapest way to get one of an item, memoizing the result
+        unless the item is part of a cycle.
+
+        Args:
+            item_id (int): Item to evaluate.
+            visiting (set): Items currently being evaluated further up the
+                stack. An ingredient in this set is part of a cycle and is
+                priced at its buy price instead of being crafted.
+
+        Returns (tuple):
+            The memo entry: best cost, recipe id or None if buying is
+            cheapest, and cheapest craft cost.
+        """
+        if item_id in self._memo:
+            return self._memo[item_id]
+        inf = float('inf')
+        buy = self._prices.get(item_id, inf)
+        craft, via = inf, None
+        visiting.add(item_id)
+        for recipe_id, out_count, ingredients in self._recipes.get(item_id,
+                                                                   ()):
+            total = 0.0
+            for ingredient, amount in ingredients:
+                if ingredient in visiting:
+                    cost = self._prices.get(ingredient, inf)
+                else:
+                    cost = self._evaluate(ingredient, visiting)[0]
+                total += cost * amount
+                if total >= craft * out_count:
+                    break
+            unit = total / out_count
+            if unit < craft:
+                craft, via = unit, recipe_id
+        visiting.discard(item_id)
+        entry = (buy, None, craft) if buy <= craft else (craft, via, craft)
+        if item_id not in self._cyclic:
+            self._memo[item_id] = entry
+        return entry
+
+    def cost(self, item_id):
+        """
+        Get the cheapest cost of one of an item, bought or crafted.
+
+        Args:
+            item_id (int): Item to price.
+
+        Returns (float):
+            The cost, or inf if the item can neither be bought nor crafted.
+        """
+        return self._evaluate(item_id, set())[0]
+
+    def craft_cost(self, item_id):
+        """
+        Get the cheapest cost of crafting one of an item, with every
+        ingredient either bought or crafted, whichever is cheaper.
+
+        Args:
+            item_id (int): Item to price.
+
+        Returns (float):
+            The cost, or inf if the item can't be crafted.
+        """
+        return self._evaluate(item_id, set())[2]
+
+    def recipe_for(self, item_id):
+        """
+        Get the id of the recipe on the cheapest path to an item.
+
+        Args:
+            item_id (int): Item to look up.
+
+        Returns (int):
+            The recipe id, or None if buying the item is cheapest.
+        """
+        return self._evaluate(item_id, set())[1]
+
+    def craft_costs(self, item_ids=None):
+        """
+        Get the craft cost of many items in one pass, sharing every
+        intermediate result between them.
+
+        Args:
+            item_ids (iterable, optional): Items to price. Defaults to None,
+                which prices every craftable item.
+
+        Returns (dict):
+            Item id to craft cost.
+        """
+        if item_ids is None:
+            item_ids = self._recipes.keys()
+        return {i: self._evaluate(i, set())[2] for i in item_ids}
+
+
+class EquippedItem(Item):
+    """An Equipped Item object"""
+    def __repr__(self):
+        item_name = self.__class__.__name__
+        item_desc = getattr(self, 'name', getattr(self, 'id', 'Unknown'))
+        item_slot = getattr(self, 'slot', 'Unknown')
+        return f'<{item_name} "{item_desc}" in slot {item_slot}>'
+
+
+class MyEquipment(GW2List):
+    """Collection of Equipped Item on a Character"""
+    _thing_type = EquippedItem
+    _enum_type = Items
+
+
+class BankItem(Item):
+    """An Item in the bank."""
+    def __repr__(self):
+        item_name = self.__class__.__name__
+        item_desc = getattr(self, 'name', getattr(self, 'id', None))
+        item_count = getattr(self, 'count', 'Unknown')
+        return f'<{item_name} "{item_desc}" x {item_count}>'
+
+
+class Bank(GW2List):
+    """Collection of Bank Items on an Account"""
+    _endpoint_url = 'v2/account/bank'
+    _thing_type = BankItem
+
+
+class Achievement(GW2Thing):
+    _endpoint_url = 'v2/achievements'
+
+
+class Achievements(GW2Enum):
+    _endpoint_url = 'v2/achievements'
+    _thing_type = Achievement
+
+
+class MyAchievements(GW2List):
+    _endpoint_url = 'v2/account/achievements'
+    _thing_type = Achievement
+    _enum_type = Achievements
+
+
+class AchievementCategory(GW2Thing):
+    """Achievement category object"""
+    _endpoint_url = 'v2/achievements/categories'
+
+
+class AchievementCategories(GW2Enum):
+    """Collection of AchievementCategories"""
+    _endpoint_url = 'v2/achievements/categories'
+    _thing_type = AchievementCategory
+
+
+class AchievementGroup(GW2Thing):
+    """Achievement group object"""
+    _endpoint_url = 'v2/achievements/groups'
+
+
+class AchievementGroups(GW2Enum):
+    """Collection of AchievementGroups"""
+    _endpoint_url = 'v2/achievements/groups'
+    _thing_type = AchievementGroup
+
+
+class AchievementProgress(GW2API):
+    """
+    An Account's achievement progress joined to the achievement definitions,
+    with completion rolled up per category and per group.
+
+    Definitions, categories and groups are fetched once and kept (and come
+    from the session's cache, if it has one), so refresh() only re-fetches
+    v2/account/achievements, plus the definitions of any achievement seen
+    for the first time. Progress is joined to definitions by id.
+    """
+    _endpoint_url = 'v2/account/achievements'
+
+    def __init__(self, session=None):
+        """
+        Prepares an AchievementProgress for use.
+
+        Args:
+            session (GW2APISession, optional): Session to use to make calls.
+        """
+        super(AchievementProgress, self).__init__(session=session)
+        self._definitions = {}
+        self._categories = None
+        self._groups = None
+        self.progress = {}
+        self.categories = {}
+        self.groups = {}
+        self._log.info(f'Initialized {self}')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self.progress)} ' \
+               f'achievements in {len(self.categories)} categories>'
+
+    def __getitem__(self, achievement_id):
+        """
+        Get the joined record for an achievement.
+
+        Args:
+            achievement_id (int): Achievement id.
+
+        Returns (dict):
+            The definition, overlaid with the Account's progress (current,
+            max, done...) and the earned and points totals.
+        """
+        return self.progress[achievement_id]
+
+    def _fetch(self, url, ids):
+        """
+        Bulk fetch records by id, a page at a time.
+
+        Args:
+            url (str): Bulk endpoint URL.
+            ids (list): Ids to fetch.
+
+        Returns (list):
+            The records found.
+        """
+        page_size = endpoint_for(url).page_size
+        records = []
+        for n in range(0, len(ids), page_size):
+            records.extend(self._session.make_request(url, params={
+                'ids': ','.join(str(i) for i in ids[n:n + page_size])}))
+        return records
+
+    def _load_definitions(self, progress):
+        """
+        Fetch categories and groups the first time, and the definitions of
+        any achievements, in progress or in a category, not already known.
+        Ids the API has no definition for are kept as None, so they aren't
+        asked for again.
+        """
+        if self._categories is None:
+            self._categories = self._session.make_request(
+                'v2/achievements/categories', params={'ids': 'all'})
+            self._groups = self._session.make_request(
+                'v2/achievements/groups', params={'ids': 'all'})
+        ids = set(progress).union(*(c.get('achievements', [])
+                                    for c in self._categories))
+        missing = sorted(ids - self._definitions.keys())
+        if missing:
+            self._log.debug(f'Fetching {len(missing)} definitions')
+            self._definitions.update(dict.fromkeys(missing))
+            self._definitions.update(
+                (r['id'], r) for r in self._fetch('v2/achievements', missing))
+
+    @staticmethod
+    def _points(definition, progress):
+        """
+        Work out the points an achievement is worth and has earned.
+
+        Args:
+            definition (dict): Achievement definition.
+            progress (dict): Account progress on it, or None.
+
+        Returns (tuple):
+            (points available, points earned)
+        """
+        tiers = definition.get('tiers') or []
+        points = sum(t.get('points', 0) for t in tiers)
+        if not progress:
+            return points, 0
+        if progress.get('done'):
+            return points, points
+        current = progress.get('current', 0)
+        return points, sum(t.get('points', 0) for t in tiers
+                           if current >= t.get('count', 0))
+
+    @staticmethod
+    def _rollup(record, stats):
+        """Total up stats into a category or group record."""
+        total = sum(s[0] for s in stats)
+        done = sum(s[1] for s in stats)
+        points = sum(s[2] for s in stats)
+        earned = sum(s[3] for s in stats)
+        return {
+            'id': record.get('id'),
+            'name': record.get('name'),
+            'total': total,
+            'done': done,
+            'completion': done / total if total else 1.0,
+            'points': points,
+            'earned': earned,
+            'remaining': points - earned,
+        }
+
+    @_traced('refresh')
+    def refresh(self):
+        """
+        Re-fetch the Account's progress, join it to the definitions and
+        recompute the category and group rollups.
         """
-        self._log.info(f'Refreshing {self}')
-        self._log.debug(f'ID list to query:\n{pformat(self._ids)}')
         timer = time.time()
-        if self._enum_type and all(isinstance(i, dict) for i in self._ids):
-            got_things = self._enum_type(session=self._session)\
-                .get([i.get('id') for i in self._ids])
-            for got_thing, orig_thing in zip(got_things, self._ids):
-                if got_thing.id == orig_thing.get('id'):
-                    got_thing._update_obj(orig_thing)
-            self._things = got_things
-        elif self._enum_type:
-            self._things = self._enum_type.get(self._ids)
-        else:
-            with ThreadPool(1) as pool:
-                got_things = pool.map(
-                    self.get_thing,
-                    [(self._session, self._thing_type, t)
-                     for t in self._ids]
-                )
-            self._things = [t for t in got_things if t is not None]
-        self.count = len(self._things)
-        req_time = time.time() - timer
-        self._log.info(f'Found {self.count} items in {req_time:4.2f}s')
+        progress = {p['id']: p for p in self._session.make_request(
+            self._endpoint_url) if p and 'id' in p}
+        self._load_definitions(progress)
+        joined = {}
+        for achievement_id, definition in self._definitions.items():
+            if definition is None:
+                continue
+            record = progress.get(achievement_id)
+            points, earned = self._points(definition, record)
+            joined[achievement_id] = {**definition, **(record or {}),
+                                      'points': points, 'earned': earned}
+        orphans = progress.keys() - joined.keys()
+        if orphans:
+            self._log.warning(f'No definitions for achievements {orphans}')
+        self.progress = joined
+        categories = {}
+        for category in self._categories:
+            stats = [
+                (1, bool(joined[i].get('done')),
+                 joined[i]['points'], joined[i]['earned'])
+                for i in category.get('achievements', []) if i in joined
+            ]
+            categories[category['id']] = (self._rollup(category, stats),
+                                          stats)
+        self.categories = {k: v[0] for k, v in categories.items()}
+        self.groups = {
+            group['id']: self._rollup(group, [
+                s for c in group.get('categories', []) if c in categories
+                for s in categories[c][1]])
+            for group in self._groups
+        }
+        self._log.info(f'Joined {len(progress)} progress records in '
+                       f'{time.time() - timer:4.2f}s')
+
+
+class Currency(GW2Thing):
+    """Currency object"""
+    _endpoint_url = 'v2/currencies'
+
+
+class Currencies(GW2Enum):
+    """Collection of Currencies"""
+    _endpoint_url = 'v2/currencies'
+    _thing_type = Currency
+
+
+class Wallet(GW2List):
+    """Collection of Currencies held by an Account"""
+    _endpoint_url = 'v2/account/wallet'
+    _thing_type = Currency
+    _enum_type = Currencies
+
+
+class MaterialItem(Item):
+    """An Item in material storage."""
+    def __repr__(self):
+        item_name = self.__class__.__name__
+        item_desc = getattr(self, 'name', getattr(self, 'id', None))
+        item_count = getattr(self, 'count', 'Unknown')
+        return f'<{item_name} "{item_desc}" x {item_count}>'
+
+
+class Materials(GW2List):
+    """Collection of Material Items in an Account's material storage"""
+    _endpoint_url = 'v2/account/materials'
+    _thing_type = MaterialItem
+    _enum_type = Items
+
+
+class InventoryItem(Item):
+    """An Item held by an Account, with every slot it is held in."""
+    def __repr__(self):
+        item_name = self.__class__.__name__
+        item_desc = getattr(self, 'name', getattr(self, 'id', None))
+        item_count = getattr(self, 'count', 'Unknown')
+        slots = len(getattr(self, 'locations', []))
+        return f'<{item_name} "{item_desc}" x {item_count} in {slots} slots>'
+
+
+class InventoryItems(GW2Enum):
+    """Collection of items, as InventoryItems"""
+    _endpoint_url = 'v2/items'
+    _thing_type = InventoryItem
+
+
+class Inventory(GW2API):
+    """
+    Every item on an Account, across the bank, material storage and the bags
+    of every character, collapsed into one InventoryItem per item id. Each
+    distinct item is hydrated once, through bulk v2/items requests, so a
+    refresh takes a handful of calls no matter how many slots hold an item.
+    """
+    # Endpoints refresh() reads, whose scopes Inventory needs between them.
+    _sources = ('bank', 'materials', 'characters')
+
+    def __init__(self, session=None):
+        """
+        Prepares an Inventory for use.
+
+        Args:
+            session (GW2APISession, optional): Session to use to make calls.
+        """
+        super(Inventory, self).__init__(session=session)
+        self._things = None
+        self.empty = {}
+        self.count = 0
+        self._log.info(f'Initialized {self}')
+
+    def __repr__(self):
+        items = f'{len(self._things)} items' \
+            if self._things is not None \
+            else '?? items'
+        return f'<{self.__class__.__name__} {items}>'
+
+    @property
+    def _required_scopes(self):
+        """Token scopes of every endpoint in _sources, from ENDPOINTS."""
+        return sorted({s for name in self._sources
+                       for s in ENDPOINTS[name].scopes})
+
+    def __iter__(self):
+        """
+        Iterate over the items. Causes a refresh if it hasn't been previously.
+        """
+        if self._things is None:
+            self.refresh()
+        return iter(self._things.values())
+
+    def __len__(self):
+        if self._things is None:
+            self.refresh()
+        return len(self._things)
+
+    def __getitem__(self, item_id):
+        if self._things is None:
+            self.refresh()
+        return self._things[item_id]
+
+    def __contains__(self, item_id):
+        if self._things is None:
+            self.refresh()
+        return item_id in self._things
+
+    def _slots(self):
+        """
+        Gather every occupied slot on the account, counting the empty ones
+        in self.empty as it goes.
+
+        Yields (tuple):
+            (item id, count, location) for each occupied slot. Locations are
+            ('bank', slot), ('materials', category) or
+            (character name, bag, slot).
+        """
+        self.empty = {}
+        bank = self._session.make_request(ENDPOINTS['bank'].path)
+        for n, slot in enumerate(bank):
+            if slot:
+                yield slot['id'], slot.get('count', 1), ('bank', n)
+            else:
+                self.empty['bank'] = self.empty.get('bank', 0) + 1
+        materials = self._session.make_request(ENDPOINTS['materials'].path)
+        for slot in materials:
+            if slot and slot.get('count'):
+                yield slot['id'], slot['count'], \
+                    ('materials', slot.get('category'))
+        characters = self._session.make_request(
+            ENDPOINTS['characters'].path, params={'ids': 'all'})
+        for character in characters:
+            name = character.get('name')
+            for b, bag in enumerate(character.get('bags') or []):
+                if not bag:
+                    continue
+                for n, slot in enumerate(bag.get('inventory') or []):
+                    if slot:
+                        yield slot['id'], slot.get('count', 1), (name, b, n)
+                    else:
+                        self.empty[name] = self.empty.get(name, 0) + 1
+
+    @_traced('refresh')
+    def refresh(self):
+        """
+        Go get the contents of every storage on the account, collapse them
+        by item id, and hydrate each distinct item once.
+        """
+        self._log.info(f'Refreshing {self}')
+        timer = time.time()
+        counts, locations = {}, {}
+        for item_id, amount, location in self._slots():
+            counts[item_id] = counts.get(item_id, 0) + amount
+            locations.setdefault(item_id, []).append((location, amount))
+        things = {}
+        for thing in InventoryItems(session=self._session).get(
+                sorted(counts)):
+            thing.count = counts[thing.id]
+            thing.locations = locations[thing.id]
+            things[thing.id] = thing
+        unknown = set(counts) - set(things)
+        if unknown:
+            self._log.warning(f'Items not found in v2/items: {unknown}')
+        self._things = things
+        self.count = sum(t.count for t in things.values())
+        self._log.info(f'Found {self.count} of {len(things)} distinct items '
+                       f'in {time.time() - timer:4.2f}s')
+
+
+class CacheWarmer(object):
+    """
+    Prefetches a declared set of endpoints into a session's cache on a
+    background thread, so a fresh process reaches warm cache latency
+    without waiting on user requests to fill it.
+
+    Warming uses only spare rate budget: its requests leave `reserve` tokens
+    in the session's RateLimiter for foreground traffic, queue in the bulk
+    class of the session's RequestScheduler, and can be held to a lower rate
+    of their own.
+    """
+    def __init__(self, session, plan, reserve=None, rate=None):
+        """
+        Prepares a CacheWarmer for use.
+
+        Args:
+            session (GW2APISession): Session to warm. Must have a cache.
+            plan (iterable): (endpoint, ids) or (endpoint, ids, priority)
+                tuples. endpoint is a name in ENDPOINTS; ids is 'all', a list
+                of ids, or None for endpoints without ids. For templated
+                endpoints, ids lists what to fill the path with: ids for an
+                {id} path, or dicts of every placeholder, eg. {'continent':
+                1, 'floor': 0}. Entries are warmed lowest priority number
+                first (default 0), then in order.
+            reserve (int, optional): Rate limiter tokens to leave for
+                foreground requests. Defaults to None, which leaves half of
+                the limiter's burst.
+            rate (float, optional): Most warming requests per second, on top
+                of the session's limiter. Defaults to None.
+
+        Raises:
+            ValueError: If the session has no cache, the plan names an
+                unknown endpoint or one that is never cached (ttl=0), which
+                warming would only spend requests on, or the ids of a
+                templated endpoint don't fill its placeholders.
+        """
+        if session.cache is None:
+            raise ValueError('CacheWarmer needs a session with a cache')
+        entries = []
+        for n, entry in enumerate(plan):
+            name, ids = entry[0], entry[1]
+            priority = entry[2] if len(entry) > 2 else 0
+            if name not in ENDPOINTS:
+                raise ValueError(f'Unknown endpoint: {name}')
+            endpoint = ENDPOINTS[name]
+            if not endpoint.ttl:
+                raise ValueError(f'Endpoint {name} is never cached')
+            if endpoint.templated:
+                ids = [self._fill(name, endpoint, i) for i in ids or []]
+            entries.append((priority, n, ENDPOINTS[name], ids))
+        self._plan = [e[2:] for e in sorted(entries)]
+        self._session = session
+        limiter = session.rate_limiter
+        self.reserve = reserve if reserve is not None \
+            else (limiter.burst // 2 if limiter is not None else 0)
+        self._limiter = RateLimiter(rate) if rate else None
+        self.done = 0
+        self.total = 0
+        self.errors = []
+        self.started_at = None
+        self.finished_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _fill(name, endpoint, value):
+        """
+        Check what a plan entry fills a templated endpoint's path with.
+
+        Returns (dict):
+            Placeholder name to value.
+
+        Raises:
+            ValueError: If value doesn't fill every placeholder.
+        """
+        wanted = set(endpoint.placeholders)
+        if not isinstance(value, dict):
+            if wanted != {'id'}:
+                raise ValueError(f'Endpoint {name} needs a dict of '
+                                 f'{sorted(wanted)}, not {value!r}')
+            return {'id': value}
+        if set(value) != wanted:
+            raise ValueError(f'Endpoint {name} needs {sorted(wanted)}, '
+                             f'not {sorted(value)}')
+        return value
+
+    def __repr__(self):
+        state = 'finished' if self.finished_at \
+            else 'running' if self.started_at else 'idle'
+        return f'<{self.__class__.__name__} {state} ' \
+               f'{self.done}/{self.total} requests>'
+
+    @property
+    def progress(self):
+        """Fraction of the known requests completed, from 0 to 1."""
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def eta(self):
+        """
+        Estimated seconds until warming finishes, from the average time per
+        request so far. None until a request has completed, 0 once finished.
+        """
+        if self.finished_at:
+            return 0.0
+        if not self.done:
+            return None
+        per_request = (time.time() - self.started_at) / self.done
+        return per_request * (self.total - self.done)
+
+    def start(self):
+        """
+        Start warming on a background daemon thread.
+
+        Returns (CacheWarmer):
+            self, so it can be chained from the constructor.
+        """
+        self.started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, name=f'{self.__class__.__name__}', daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """
+        Wait for warming to finish.
+
+        Args:
+            timeout (float, optional): Most seconds to wait.
+
+        Returns (bool):
+            Whether warming has finished.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished_at is not None
+
+    def stop(self):
+        """Stop warming after the current request."""
+        self._stop.set()
+
+    def _requests(self):
+        """
+        Expand the plan into requests, adding to self.total as id lists are
+        discovered. An entry that can't be expanded is recorded in errors,
+        and the rest of the plan carries on.
+
+        Yields (tuple):
+            (url, params) of each request to make.
+        """
+        for endpoint, ids in self._plan:
+            try:
+                requests = self._expand(endpoint, ids)
+            except Exception as e:
+                self._failed(endpoint.path, None, e)
+                continue
+            self.total += len(requests)
+            yield from requests
+
+    def _expand(self, endpoint, ids):
+        """
+        Expand a single plan entry into requests, fetching its id list if it
+        asks for 'all'.
+
+        Returns (list):
+            (url, params) of each request to make.
+        """
+        if endpoint.templated:
+            return [(endpoint.url(**fill), None) for fill in ids]
+        if ids is None or not endpoint.bulk:
+            return [(endpoint.path, None)]
+        if ids == 'all':
+            self.total += 1
+            try:
+                ids = self._session.make_request(endpoint.path)
+            finally:
+                self.done += 1
+        size = endpoint.page_size
+        return [(endpoint.path,
+                 {'ids': ','.join(str(i) for i in ids[n:n + size])})
+                for n in range(0, len(ids), size)]
+
+    def _failed(self, url, params, error):
+        """Record and log a failed request, so warming can carry on."""
+        MODULE_LOG.warning(f'Cache warming failed on {url}: {error!r}')
+        self.errors.append((url, params, error))
+
+    def _run(self):
+        """Worker thread: make every request in the plan."""
+        _RATE_RESERVE.set(self.reserve)
+        _PRIORITY.set('bulk')
+        MODULE_LOG.info(f'Warming cache with {self}')
+        try:
+            for url, params in self._requests():
+                if self._stop.is_set():
+                    break
+                if self._limiter is not None:
+                    self._limiter.acquire()
+                try:
+                    self._session.make_request(url, params=params)
+                except Exception as e:
+                    self._failed(url, params, e)
+                self.done += 1
+        except Exception as e:
+            self._failed(None, None, e)
+        finally:
+            self.finished_at = time.time()
+            MODULE_LOG.info(f'Cache warming finished in '
+                            f'{self.finished_at - self.started_at:4.2f}s '
+                            f'with {len(self.errors)} errors')
+
+
+class Build(GW2Thing):
+    """Current game build"""
+    _endpoint_url = 'v2/build'
+
+
+class Color(GW2Thing):
+    """Dye color object"""
+    _endpoint_url = 'v2/colors'
+    _identity_mapped = True
+
+
+class Colors(GW2Enum):
+    """Collection of dye Colors"""
+    _endpoint_url = 'v2/colors'
+    _thing_type = Color
+
+    def palette(self):
+        """
+        Load every dye into a DyePalette for searching by appearance.
+
+        Returns (DyePalette):
+            The palette.
+        """
+        return DyePalette(self.get_raw())
+
+
+def _srgb_to_lab(rgb):
+    """
+    Convert an sRGB color to CIELAB (D65 white point).
+
+    Args:
+        rgb (iterable): Red, green and blue, 0-255.
+
+    Returns (tuple):
+        L*, a* and b*.
+    """
+    linear = []
+    for channel in rgb:
+        c = channel / 255.0
+        linear.append(c / 12.92 if c <= 0.04045
+                      else ((c + 0.055) / 1.055) ** 2.4)
+    r, g, b = linear
+    xyz = ((0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047,
+           (0.2126729 * r + 0.7151522 * g + 0.0721750 * b),
+           (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883)
+    fx, fy, fz = (t ** (1 / 3) if t > 216 / 24389
+                  else (24389 / 27 * t + 16) / 116 for t in xyz)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+class DyePalette(object):
+    """
+    Every dye's cloth, leather and metal appearance, packed into flat arrays
+    of CIELAB values (one per channel per material), for finding the dyes
+    closest to a color. Distance is CIE76 delta E, the Euclidean distance in
+    LAB, which tracks perceived difference far better than RGB distance.
+    """
+    MATERIALS = ('cloth', 'leather', 'metal')
+
+    def __init__(self, colors):
+        """
+        Prepares a DyePalette for use.
+
+        Args:
+            colors (iterable): Color objects or v2/colors records.
+        """
+        self.ids = array('q')
+        self._names = []
+        self._lab = {m: (array('d'), array('d'), array('d'))
+                     for m in self.MATERIALS}
+        self._rgb = {m: array('B') for m in self.MATERIALS}
+        for color in colors:
+            info = color if isinstance(color, dict) else color._as_record()
+            if not all((info.get(m) or {}).get('rgb')
+                       for m in self.MATERIALS):
+                continue
+            self.ids.append(info['id'])
+            self._names.append(info.get('name'))
+            for m in self.MATERIALS:
+                rgb = info[m]['rgb']
+                self._rgb[m].extend(rgb)
+                for channel, value in zip(self._lab[m], _srgb_to_lab(rgb)):
+                    channel.append(value)
+        self._index = {id: n for n, id in enumerate(self.ids)}
+        MODULE_LOG.debug(f'Built {self}')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self.ids)} dyes>'
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, color_id):
+        return color_id in self._index
+
+    def rgb(self, color_id, material='cloth'):
+        """
+        Get a dye's RGB color on a material.
+
+        Args:
+            color_id (int): Dye id.
+            material (str, optional): cloth, leather or metal. Defaults to
+                cloth.
+
+        Returns (tuple):
+            Red, green and blue, 0-255.
+        """
+        n = self._index[color_id] * 3
+        return tuple(self._rgb[material][n:n + 3])
 
-    @staticmethod
-    def get_thing(args):
+    def name(self, color_id):
+        """Get a dye's name."""
+        return self._names[self._index[color_id]]
+
+    def nearest(self, rgb, material='cloth', k=5):
         """
-        Static method called by the ThreadPool to make API calls and get
-        objects.
+        Find the dyes that look closest to a color on a material.
 
         Args:
-            args (tuple): A 3 element tuple containing the session,
-                thing_type, and thing to get.
+            rgb (iterable): Red, green and blue, 0-255.
+            material (str, optional): cloth, leather or metal. Defaults to
+                cloth.
+            k (int, optional): Number of dyes to find. Defaults to 5.
 
-        Returns (GWThing):
-            A GW2Thing object of thing_type type that represents the item.
+        Returns (list):
+            Up to k (delta E, dye id) tuples, closest first.
+
+        Raises:
+            ValueError: If material isn't one of MATERIALS.
         """
-        MODULE_LOG.debug(f'get_thing with: {args}')
-        session, thing_type, thing = args
-        if isinstance(thing, dict) and thing.get('id'):
-            thing_obj = thing_type(thing.get('id'), session=session)
-            thing_obj._update_obj(thing)
-        elif isinstance(thing, str):
-            thing_obj = thing_type(thing, session=session)
-        else:
-            return None
-        return thing_obj
+        if material not in self._lab:
+            raise ValueError(f'Unknown material {material!r}, expected one '
+                             f'of {self.MATERIALS}')
+        lightness0, a0, b0 = _srgb_to_lab(rgb)
+        lightnesses, as_, bs = self._lab[material]
+        distances = [(lightness - lightness0) * (lightness - lightness0)
+                     + (a - a0) * (a - a0) + (b - b0) * (b - b0)
+                     for lightness, a, b in zip(lightnesses, as_, bs)]
+        ids = self.ids
+        return [(distances[n] ** 0.5, ids[n]) for n in heapq.nsmallest(
+            k, range(len(distances)), key=distances.__getitem__)]
 
 
-class GW2Enum(GW2API):
+class Continent(GW2Thing):
+    """Continent object"""
+    _endpoint_url = 'v2/continents'
+    _identity_mapped = True
+
+    def floor(self, floor):
+        """
+        Get one of the continent's floors.
+
+        Args:
+            floor (int): Floor id, from self.floors.
+
+        Returns (Floor):
+            The floor.
+        """
+        return Floor(self.id, floor, session=self._session)
+
+
+class Continents(GW2Enum):
+    """Collection of Continents"""
+    _endpoint_url = 'v2/continents'
+    _thing_type = Continent
+
+
+class Floor(GW2Thing):
     """
-    A class representing an Enumeration of types. Usually, these types allow
-    searching for specifics items based on criteria.
+    A floor of a Continent, with its regions, maps, points of interest and
+    sectors.
+    """
+    _endpoint_url = 'v2/continents'
 
-    Ensure _thing_type is set in subclasses.
+    def __init__(self, continent, floor, session=None):
+        self._endpoint_url = ENDPOINTS['continent_floor'].url(
+            continent=continent, floor=floor)
+        super(Floor, self).__init__(session=session)
+        self.id = floor
+        self.continent = continent
+
+    def spatial_index(self, cell_size=None):
+        """
+        Build a SpatialIndex of the floor.
+
+        Args:
+            cell_size (float, optional): See SpatialIndex.
+
+        Returns (SpatialIndex):
+            The index.
+        """
+        return SpatialIndex.from_floor(self._as_record(), cell_size=cell_size)
+
+
+class Map(GW2Thing):
+    """Map object"""
+    _endpoint_url = 'v2/maps'
+    _identity_mapped = True
+
+
+class Maps(GW2Enum):
+    """Collection of Maps"""
+    _endpoint_url = 'v2/maps'
+    _thing_type = Map
+
+
+class SpatialIndex(object):
     """
-    _thing_type = GW2Thing
+    A uniform grid over the points (points of interest, waypoints, hearts)
+    and shapes (sectors, and maps by their continent_rect) of a Floor, in
+    continent coordinates. Answers k-nearest point and point-in-shape
+    queries by looking only at the grid cells near the query, instead of
+    scanning the whole floor.
 
-    def __init__(self, session=None):
+    An index can be written to and loaded from a CatalogSnapshot file.
+    """
+    def __init__(self, points=(), shapes=(), cell_size=None):
         """
-        Prepare a GW2Enum for use.
+        Prepares a SpatialIndex for use.
 
         Args:
-            session (GW2APISession, optional): Session to use to make calls.
-                Defaults to None, which is replaced with a new session.
+            points (iterable): Point records: dicts with coord [x, y], kind,
+                and whatever else should be returned (id, type, name...).
+            shapes (iterable): Shape records: dicts with bounds (a list of
+                [x, y] polygon vertices), kind ('sector' or 'map'), and
+                whatever else should be returned.
+            cell_size (float, optional): Width of a grid cell. Defaults to
+                None, which picks a size that puts a few points in each
+                occupied cell.
         """
-        super(GW2Enum, self).__init__(session=session)
-        self._log.info(f'Initialized {self}')
+        self.points = list(points)
+        self.shapes = list(shapes)
+        self._xs = [p['coord'][0] for p in self.points]
+        self._ys = [p['coord'][1] for p in self.points]
+        if cell_size is None:
+            cell_size = self._pick_cell_size()
+        self.cell_size = float(cell_size)
+        self._point_cells = {}
+        for n, (x, y) in enumerate(zip(self._xs, self._ys)):
+            self._point_cells.setdefault(self._cell(x, y), []).append(n)
+        self._boxes = []
+        self._shape_cells = {}
+        for n, shape in enumerate(self.shapes):
+            xs = [v[0] for v in shape['bounds']]
+            ys = [v[1] for v in shape['bounds']]
+            box = (min(xs), min(ys), max(xs), max(ys))
+            self._boxes.append(box)
+            (x0, y0), (x1, y1) = self._cell(*box[:2]), self._cell(*box[2:])
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self._shape_cells.setdefault((cx, cy), []).append(n)
+        cells = self._point_cells.keys() or [(0, 0)]
+        self._cell_bounds = (min(c[0] for c in cells),
+                             min(c[1] for c in cells),
+                             max(c[0] for c in cells),
+                             max(c[1] for c in cells))
+        MODULE_LOG.debug(f'Built {self}')
 
     def __repr__(self):
-        """repr() output."""
-        return f'<{self.__class__.__name__} of {self._thing_type.__name__}>'
+        return f'<{self.__class__.__name__} {len(self.points)} points, ' \
+               f'{len(self.shapes)} shapes, cell {self.cell_size:g}>'
 
-    def get(self, id=None):
+    def _pick_cell_size(self):
+        """Size cells to hold about four points each over the bounding box."""
+        if len(self.points) < 2:
+            return 1024.0
+        area = (max(self._xs) - min(self._xs) or 1) * \
+            (max(self._ys) - min(self._ys) or 1)
+        return max(1.0, (area * 4 / len(self.points)) ** 0.5)
+
+    def _cell(self, x, y):
+        """Grid cell holding a coordinate."""
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    @classmethod
+    def from_floor(cls, floor, cell_size=None):
         """
-        Get a specified item by id.
+        Build an index from a v2/continents/:id/floors/:floor record.
 
         Args:
-            id (str or list, optional): ID to call for. Defaults to None,
-                which is replaced with 'all'.
+            floor (dict): The floor record.
+            cell_size (float, optional): See __init__().
 
-        Returns (GW2Thing):
-            A GW2Thing of the type in self._thing_type with the object.
+        Returns (SpatialIndex):
+            The index.
         """
-        if id is None:
-            id = 'all'
-        if any(isinstance(id, t) for t in (list, tuple)):
-            for i in range(0, len(id), 3):
-                ids = ','.join([str(a) for a in id[i:i+20]])
-                return [
-                    self._thing_type(g, session=self._session)
-                    for g in self._session.make_request(
-                        self._endpoint_url, params={'ids': ids}
-                    )
-                ]
-        else:
-            return self._thing_type(
-                self._session.make_request(self._endpoint_url, {'id': id}),
-                session=self._session,
-            )
+        points, shapes = [], []
+        for region_id, region in (floor.get('regions') or {}).items():
+            for map_id, map_info in (region.get('maps') or {}).items():
+                where = {'map_id': int(map_id), 'region_id': int(region_id)}
+                rect = map_info.get('continent_rect')
+                if rect:
+                    (x0, y0), (x1, y1) = rect
+                    shapes.append({
+                        'kind': 'map', 'id': int(map_id),
+                        'name': map_info.get('name'), **where,
+                        'bounds': [[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+                    })
+                for sector in (map_info.get('sectors') or {}).values():
+                    if sector.get('bounds'):
+                        shapes.append({'kind': 'sector', **sector, **where})
+                for poi in (map_info.get('points_of_interest') or {}).values():
+                    points.append({'kind': poi.get('type', 'poi'), **poi,
+                                   **where})
+                for task in (map_info.get('tasks') or {}).values():
+                    points.append({'kind': 'task', **task, **where})
+                for challenge in map_info.get('skill_challenges') or []:
+                    points.append({'kind': 'skill_challenge', **challenge,
+                                   **where})
+        return cls(points, shapes, cell_size=cell_size)
 
+    def nearest(self, x, y, k=1, kind=None):
+        """
+        Find the points closest to a coordinate.
 
-class Token(GW2Thing):
-    """Token object"""
-    _endpoint_url = 'v2/tokeninfo'
+        Args:
+            x (float): Continent x coordinate.
+            y (float): Continent y coordinate.
+            k (int, optional): Number of points to find. Defaults to 1.
+            kind (str or iterable, optional): Only consider points of this
+                kind (or these kinds), eg. 'waypoint'. Defaults to None, which
+                considers every point.
 
-    def __repr__(self):
-        item_name = getattr(self, 'name', 'Unknown')
-        item_perms = getattr(self, 'permissions', [])
-        return f'<{self.__class__.__name__} "{item_name}" with scopes ' \
-               f'{", ".join(item_perms)}>'
+        Returns (list):
+            Up to k (distance, point record) tuples, closest first.
 
-    def __str__(self):
-        item_name = getattr(self, 'name', 'Unknown')
-        item_perms = getattr(self, 'permissions', [])
-        return f'"{item_name}" with scopes {", ".join(item_perms)}'
+        Raises:
+            ValueError: If k is negative.
+        """
+        if k < 0:
+            raise ValueError(f'k must not be negative, not {k}')
+        if k == 0:
+            return []
+        if isinstance(kind, str):
+            kind = {kind}
+        points, xs, ys = self.points, self._xs, self._ys
+        cells, size = self._point_cells, self.cell_size
+        cx, cy = self._cell(x, y)
+        x0, y0, x1, y1 = self._cell_bounds
+        last_ring = max(cx - x0, x1 - cx, cy - y0, y1 - cy)
+        best = []  # Max heap of (-distance squared, index).
+        ring = 0
+        while True:
+            if ring == 0:
+                ring_cells = [(cx, cy)]
+            else:
+                ring_cells = [(cx + dx, cy + dy)
+                              for dx in range(-ring, ring + 1)
+                              for dy in (-ring, ring)]
+                ring_cells += [(cx + dx, cy + dy)
+                               for dx in (-ring, ring)
+                               for dy in range(-ring + 1, ring)]
+            for cell in ring_cells:
+                for n in cells.get(cell, ()):
+                    if kind is not None and points[n]['kind'] not in kind:
+                        continue
+                    d2 = (xs[n] - x) ** 2 + (ys[n] - y) ** 2
+                    if len(best) < k:
+                        heapq.heappush(best, (-d2, n))
+                    elif d2 < -best[0][0]:
+                        heapq.heapreplace(best, (-d2, n))
+            # Anything outside this ring is at least ring cells away.
+            if len(best) == k and -best[0][0] <= (ring * size) ** 2:
+                break
+            if ring >= last_ring:
+                break
+            ring += 1
+        return [((-d2) ** 0.5, points[n]) for d2, n in sorted(best,
+                                                              reverse=True)]
 
+    def containing(self, x, y, kind=None):
+        """
+        Find the shapes a coordinate is inside.
 
-class Account(GW2Thing):
-    """Account object"""
-    _endpoint_url = 'v2/account'
-    _required_scopes = ['account']
+        Args:
+            x (float): Continent x coordinate.
+            y (float): Continent y coordinate.
+            kind (str, optional): Only consider shapes of this kind, 'sector'
+                or 'map'. Defaults to None, which considers both.
 
-    def __init__(self, session=None):
-        super(Account, self).__init__(session=session)
-        self.world = World(self.world, session=session)
-        self.guilds = MyGuilds(ids=self.guilds, session=session)
-        self.bank = Bank(session=session)
-        self.characters = MyCharacters(session=session)
-        self.achievements = MyAchievements(session=session)
-        self._log.debug(f'Account initialized with {self.__dict__}')
+        Returns (list):
+            Shape records the coordinate is inside.
+        """
+        found = []
+        for n in self._shape_cells.get(self._cell(x, y), ()):
+            shape = self.shapes[n]
+            if kind is not None and shape['kind'] != kind:
+                continue
+            x0, y0, x1, y1 = self._boxes[n]
+            if x0 <= x <= x1 and y0 <= y <= y1 and \
+                    self._inside(x, y, shape['bounds']):
+                found.append(shape)
+        return found
 
+    @staticmethod
+    def _inside(x, y, polygon):
+        """Ray casting point in polygon test."""
+        inside = False
+        px, py = polygon[-1]
+        for vx, vy in polygon:
+            if (vy > y) != (py > y) and \
+                    x < (px - vx) * (y - vy) / (py - vy) + vx:
+                inside = not inside
+            px, py = vx, vy
+        return inside
 
-class Character(GW2Thing):
-    """Character object"""
-    _endpoint_url = 'v2/characters'
-    _required_scopes = ['characters']
+    def write(self, path, endpoint_url=''):
+        """
+        Write the index's records to a CatalogSnapshot file. Records are
+        stored under sequential ids, points first, as ids of different kinds
+        can clash. The cell size is stored under id -1.
 
-    def __init__(self, id, session=None):
-        super(Character, self).__init__(id, session=session)
-        self.guild = Guild(self.guild, session=session)
-        self.recipes = MyRecipes(ids=self.recipes, session=session)
-        self.equipment = MyEquipment(ids=self.equipment, session=session)
+        Args:
+            path (str): File to write.
+            endpoint_url (str, optional): Floor the records came from.
 
+        Returns (int):
+            Number of records written.
+        """
+        entries = [(False, p) for p in self.points] + \
+            [(True, s) for s in self.shapes]
+        records = chain(
+            [{'id': -1, 'cell_size': self.cell_size}],
+            ({'id': n, 'shape': shape, 'record': record}
+             for n, (shape, record) in enumerate(entries)))
+        return CatalogSnapshot.write(path, records,
+                                     endpoint_url=endpoint_url) - 1
 
-class MyCharacters(GW2List):
-    """Collection of Characters for Account"""
-    _endpoint_url = 'v2/characters'
-    _thing_type = Character
-    _required_scopes = ['characters']
+    @classmethod
+    def load(cls, path, cell_size=None):
+        """
+        Rebuild an index from a file written by write().
 
+        Args:
+            path (str): File to read.
+            cell_size (float, optional): See __init__(). Defaults to None,
+                which uses the cell size the index was written with.
 
-class Guild(GW2Thing):
-    """Guild object"""
-    _endpoint_url = 'v2/guild'
+        Returns (SpatialIndex):
+            The index.
+        """
+        points, shapes = [], []
+        with CatalogSnapshot(path) as snapshot:
+            for id in snapshot:
+                entry = snapshot.record(id)
+                if id == -1:
+                    if cell_size is None:
+                        cell_size = entry['cell_size']
+                    continue
+                (shapes if entry['shape'] else points).append(entry['record'])
+        return cls(points, shapes, cell_size=cell_size)
 
-    def __init__(self, id, session=None):
-        self._endpoint_url = Guild._endpoint_url + f'/{id}'
-        super(Guild, self).__init__(session=session)
 
+class Skin(GW2Thing):
+    """Skin object"""
+    _endpoint_url = 'v2/skins'
+    _identity_mapped = True
 
-class Guilds(GW2Enum):
-    """Collection of Guilds"""
-    _endpoint_url = 'v2/guild'
-    _thing_type = Guild
 
+class Skins(GW2Enum):
+    """Collection of Skins"""
+    _endpoint_url = 'v2/skins'
+    _thing_type = Skin
 
-class MyGuilds(GW2List):
-    """Collection of Guilds for Account"""
-    _thing_type = Guild
 
+class Asset(GW2Thing):
+    """Asset (file) object"""
+    _endpoint_url = 'v2/files'
 
-class World(GW2Thing):
-    """World object"""
-    _endpoint_url = 'v2/worlds'
 
+class Assets(GW2Enum):
+    """Collection of Assets"""
+    _endpoint_url = 'v2/files'
+    _thing_type = Asset
 
-class Worlds(GW2Enum):
-    """Collection of Worlds"""
-    _endpoint_url = 'v2/worlds'
-    _thing_type = World
 
+class Quaggan(GW2Thing):
+    """Quaggan object"""
+    _endpoint_url = 'v2/quaggans'
 
-class Item(GW2Thing):
-    """Item object"""
-    _endpoint_url = 'v2/items'
 
+class Quaggans(GW2Enum):
+    """Collection of Quaggans"""
+    _endpoint_url = 'v2/quaggans'
+    _thing_type = Quaggan
 
-class Items(GW2Enum):
-    """Collection of items"""
-    _endpoint_url = 'v2/items'
-    _thing_type = Item
 
+class MaterialCategory(GW2Thing):
+    """Material storage category object"""
+    _endpoint_url = 'v2/materials'
 
-class Recipe(GW2Thing):
-    """Recipe object"""
-    _endpoint_url = 'v2/recipes'
 
+class MaterialCategories(GW2Enum):
+    """Collection of Material storage categories"""
+    _endpoint_url = 'v2/materials'
+    _thing_type = MaterialCategory
 
-class Recipes(GW2Enum):
-    """Collection of Recipes"""
-    _endpoint_url = 'v2/recipes'
-    _thing_type = Recipe
 
+class GuildUpgrade(GW2Thing):
+    """Guild upgrade object"""
+    _endpoint_url = 'v2/guild/upgrades'
 
-class MyRecipes(GW2List):
-    """Collection of Recipes on a Character"""
-    _thing_type = Recipe
 
+class GuildUpgrades(GW2Enum):
+    """Collection of Guild upgrades"""
+    _endpoint_url = 'v2/guild/upgrades'
+    _thing_type = GuildUpgrade
+
+
+class MyGuildUpgrades(GW2List):
+    """Collection of Guild upgrades unlocked by a Guild"""
+    _thing_type = GuildUpgrade
+    _enum_type = GuildUpgrades
+
+    def __init__(self, guild_id, session=None, ids=None):
+        self._endpoint_url = ENDPOINTS['guild_upgrades'].url(id=guild_id)
+        super(MyGuildUpgrades, self).__init__(session=session, ids=ids)
+
+
+class GuildWatcher(object):
+    """
+    Polls the log, members, stash, treasury and upgrades of many guilds and
+    reports what changed since the last poll as events. Log requests pass
+    the id of the newest entry seen as the since cursor, so each poll only
+    transfers new entries; the other resources are snapshots, and are diffed
+    against the previous poll. Guilds are polled concurrently, through the
+    session's rate limiter and scheduler.
+
+    Events are dicts with the guild id, the resource, the change ('new' for
+    log entries, or 'added', 'removed' or 'changed'), the key of what
+    changed, and its old and new records.
+
+    Failed requests and handler calls are logged and kept in errors as
+    (guild id, resource, exception) tuples, and polling carries on.
+    """
+    RESOURCES = ('log', 'members', 'stash', 'treasury', 'upgrades')
+
+    def __init__(self, session, guild_ids, resources=None, workers=8):
+        """
+        Prepares a GuildWatcher for use. The first poll() takes the initial
+        state and returns no events.
+
+        Args:
+            session (GW2APISession): Session with a guild leader's token.
+            guild_ids (iterable): Ids of the guilds to watch.
+            resources (iterable, optional): Which of RESOURCES to watch.
+                Defaults to None, which watches all of them.
+            workers (int, optional): Guilds polled at once. Defaults to 8.
+
+        Raises:
+            ValueError: If resources names an unknown resource.
+        """
+        self.resources = tuple(resources or self.RESOURCES)
+        unknown = set(self.resources) - set(self.RESOURCES)
+        if unknown:
+            raise ValueError(f'Unknown guild resources: {unknown}')
+        self._session = session
+        self.guild_ids = list(guild_ids)
+        self.workers = workers
+        self.cursors = {}
+        self.errors = []
+        self._state = {}
+        self._stop = threading.Event()
+        self._thread = None
 
-class EquippedItem(Item):
-    """An Equipped Item object"""
     def __repr__(self):
-        item_name = self.__class__.__name__
-        item_desc = getattr(self, 'name', getattr(self, 'id', 'Unknown'))
-        item_slot = getattr(self, 'slot', 'Unknown')
-        return f'<{item_name} "{item_desc}" in slot {item_slot}>'
+        return f'<{self.__class__.__name__} {len(self.guild_ids)} guilds, ' \
+               f'{", ".join(self.resources)}>'
 
+    @staticmethod
+    def _keyed(resource, records):
+        """Key a snapshot's records by what identifies them."""
+        if resource == 'members':
+            return {r['name']: r for r in records}
+        if resource == 'treasury':
+            return {r['item_id']: r for r in records}
+        if resource == 'upgrades':
+            return {i: i for i in records}
+        keyed = {}
+        for n, stash in enumerate(records):
+            upgrade = stash.get('upgrade_id', n)
+            keyed[(upgrade, 'coins')] = stash.get('coins')
+            for slot, item in enumerate(stash.get('inventory') or []):
+                keyed[(upgrade, slot)] = item
+        return keyed
 
-class MyEquipment(GW2List):
-    """Collection of Equipped Item on a Character"""
-    _thing_type = EquippedItem
+    @staticmethod
+    def _diff(guild_id, resource, old, new):
+        """Events for the differences between two keyed snapshots."""
+        events = []
+        for key in new.keys() - old.keys():
+            events.append({'guild': guild_id, 'resource': resource,
+                           'change': 'added', 'key': key, 'old': None,
+                           'new': new[key]})
+        for key in old.keys() - new.keys():
+            events.append({'guild': guild_id, 'resource': resource,
+                           'change': 'removed', 'key': key, 'old': old[key],
+                           'new': None})
+        for key in old.keys() & new.keys():
+            if old[key] != new[key]:
+                events.append({'guild': guild_id, 'resource': resource,
+                               'change': 'changed', 'key': key,
+                               'old': old[key], 'new': new[key]})
+        return events
 
+    def _poll_guild(self, guild_id):
+        """Poll every watched resource of one guild."""
+        session = self._session
+        events = []
+        for resource in self.resources:
+            url = ENDPOINTS[f'guild_{resource}'].url(id=guild_id)
+            try:
+                if resource == 'log':
+                    since = self.cursors.get(guild_id)
+                    entries = session.make_request(
+                        url, params=None if since is None
+                        else {'since': since})
+                    if entries:
+                        self.cursors[guild_id] = max(e['id'] for e in entries)
+                    if since is not None:
+                        events.extend(
+                            {'guild': guild_id, 'resource': 'log',
+                             'change': 'new', 'key': e['id'], 'old': None,
+                             'new': e}
+                            for e in sorted(entries, key=lambda e: e['id']))
+                    continue
+                new = self._keyed(resource, session.make_request(url))
+            except Exception as e:
+                self._failed(guild_id, resource, e)
+                continue
+            old = self._state.get((guild_id, resource))
+            self._state[(guild_id, resource)] = new
+            if old is not None:
+                events.extend(self._diff(guild_id, resource, old, new))
+        return events
+
+    def poll(self):
+        """
+        Poll every guild once.
+
+        Returns (list):
+            Events for everything that changed since the last poll.
+        """
+        timer = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(_propagating(self._poll_guild),
+                               self.guild_ids)
+            events = [e for guild_events in results for e in guild_events]
+        MODULE_LOG.debug(f'Polled {len(self.guild_ids)} guilds in '
+                         f'{time.time() - timer:4.2f}s: {len(events)} events')
+        return events
+
+    def start(self, interval, handler):
+        """
+        Poll on a background thread every interval seconds, passing each
+        event to handler.
+
+        Args:
+            interval (float): Seconds between the start of each poll.
+            handler (callable): Called with each event.
+
+        Returns (GuildWatcher):
+            self, so the watcher can be started where it's created.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=_propagating(self._run), args=(interval, handler),
+            name='GuildWatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def _failed(self, guild_id, resource, error):
+        """Record and log a failure, so polling can carry on."""
+        MODULE_LOG.warning(f'Watching {resource} of guild {guild_id} '
+                           f'failed: {error!r}')
+        self.errors.append((guild_id, resource, error))
+
+    def _run(self, interval, handler):
+        """Worker thread: poll until stopped."""
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                events = self.poll()
+            except Exception as e:
+                self._failed(None, None, e)
+                events = []
+            for event in events:
+                try:
+                    handler(event)
+                except Exception as e:
+                    self._failed(event['guild'], event['resource'], e)
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def stop(self):
+        """Stop polling, waiting for the current poll to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+# Resources snapshot_accounts() knows how to build, by name.
+SNAPSHOT_RESOURCES = {
+    'bank': Bank,
+    'characters': MyCharacters,
+    'achievements': MyAchievements,
+    'wallet': Wallet,
+    'materials': Materials,
+}
+
+
+class AccountSnapshot(object):
+    """
+    The result of snapshotting a single API key with snapshot_accounts().
+    """
+    def __init__(self, token):
+        """
+        Prepares an AccountSnapshot for use.
+
+        Args:
+            token (str): The API key this snapshot is for.
+        """
+        self.token = token
+        self.account = None
+        self.resources = {}
+        self.error = None
+        self.attempts = 0
+        self.elapsed = 0.0
 
-class BankItem(Item):
-    """An Item in the bank."""
     def __repr__(self):
-        item_name = self.__class__.__name__
-        item_desc = getattr(self, 'name', getattr(self, 'id', None))
-        item_count = getattr(self, 'count', 'Unknown')
-        return f'<{item_name} "{item_desc}" x {item_count}>'
+        name = (self.account or {}).get('name', 'Unknown')
+        state = 'ok' if self.ok else f'failed: {self.error!r}'
+        return f'<{self.__class__.__name__} "{name}" ' \
+               f'{len(self.resources)} resources {state}>'
 
+    @property
+    def ok(self):
+        """Whether the snapshot completed without an error."""
+        return self.error is None
 
-class Bank(GW2List):
-    """Collection of Bank Items on an Account"""
-    _endpoint_url = 'v2/account/bank'
-    _thing_type = BankItem
-    _required_scopes = ['inventories']
 
+def _snapshot_account(token, resources, rate_limiter, retries, timeout):
+    """
+    Build an AccountSnapshot for a single key. Called by the worker threads
+    of snapshot_accounts().
 
-class Achievement(GW2Thing):
-    _endpoint_url = 'v2/achievements'
+    Args:
+        token (str): API key to snapshot.
+        resources (list): Names of SNAPSHOT_RESOURCES to build.
+        rate_limiter (RateLimiter): Limiter shared by every key in the batch.
+        retries (int): Number of times to retry the key after an APIError.
+            A resource that comes back with anything in its missing list
+            counts as failed too.
+        timeout (float): Seconds the key may take, over every attempt, before
+            it is given up on.
 
+    Returns (AccountSnapshot):
+        The snapshot, with error set if every attempt failed. Errors other
+        than APIError are reported there as well, and not retried.
+    """
+    snapshot = AccountSnapshot(token)
+    timer = time.time()
+    with Deadline(timeout) as deadline:
+        for attempt in range(retries + 1):
+            snapshot.attempts = attempt + 1
+            try:
+                session = GW2APISession(rate_limiter=rate_limiter)
+                session.token = token
+                snapshot.account = session.make_request(
+                    Account._endpoint_url)
+                snapshot.resources = {}
+                for name in resources:
+                    resource = SNAPSHOT_RESOURCES[name](session=session)
+                    resource.refresh()
+                    missing = getattr(resource, 'missing', None)
+                    if deadline.expired:
+                        raise DeadlineExceeded(
+                            f'Deadline passed during {name}')
+                    if missing:
+                        raise APIError(f'{name} is missing {missing}')
+                    snapshot.resources[name] = resource
+                snapshot.error = None
+                break
+            except Exception as e:
+                MODULE_LOG.warning(
+                    f'Snapshot attempt {attempt + 1} failed: {e!r}')
+                snapshot.error = e
+                backoff = min(2 ** attempt, 30)
+                if not isinstance(e, APIError) \
+                        or isinstance(e, DeadlineExceeded) \
+                        or attempt == retries \
+                        or backoff >= deadline.remaining:
+                    break
+                time.sleep(backoff)
+    snapshot.elapsed = time.time() - timer
+    return snapshot
 
-class Achievements(GW2Enum):
-    _endpoint_url = 'v2/achievements'
-    _thing_type = Achievement
 
+def snapshot_accounts(tokens, resources=tuple(SNAPSHOT_RESOURCES),
+                      concurrency=16, rate=None, rate_limiter=None,
+                      retries=2, timeout=30):
+    """
+    Snapshot many accounts concurrently. Each key is handled by its own
+    session, while all of them share one RateLimiter, so throughput is bound
+    by the rate budget rather than by the length of a single account's chain
+    of requests.
 
-class MyAchievements(GW2List):
-    _endpoint_url = 'v2/account/achievements'
-    _thing_type = Achievement
-    _enum_type = Achievements
-    _required_scopes = ['progression']
+    Args:
+        tokens (iterable): API keys to snapshot.
+        resources (iterable, optional): Names from SNAPSHOT_RESOURCES to
+            build for every key. Defaults to all of them.
+        concurrency (int, optional): Number of keys worked on at once.
+            Defaults to 16.
+        rate (float, optional): Requests per second allowed across the whole
+            batch. Ignored if rate_limiter is given. Defaults to None, which
+            does not limit requests.
+        rate_limiter (RateLimiter, optional): Limiter to share with the rest
+            of the application. Defaults to None.
+        retries (int, optional): Number of times a failed key is retried.
+            Defaults to 2.
+        timeout (float, optional): Seconds each key may take, including
+            retries, before it is given up on with a DeadlineExceeded
+            error. Defaults to 30.
+
+    Yields (AccountSnapshot):
+        A snapshot for each key, in the order they finish.
+    """
+    resources = list(resources)
+    unknown = [r for r in resources if r not in SNAPSHOT_RESOURCES]
+    if unknown:
+        raise ValueError(f'Unknown snapshot resources: {unknown}')
+    if rate_limiter is None and rate:
+        rate_limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(_snapshot_account, t, resources, rate_limiter,
+                        retries, timeout)
+            for t in tokens
+        ]
+        for future in as_completed(futures):
+            yield future.result()
 
 
-if __name__ == '__main__':
-    import sys
+# Openers for dump --compress, by name.
+_COMPRESSORS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+class _Dumper(object):
+    """
+    Streams one endpoint to JSON Lines or CSV for the dump command, fetching
+    pages in parallel, writing them in order, and checkpointing after each
+    page so an interrupted dump can resume where it stopped.
+
+    For bulk endpoints the checkpoint keeps the list of ids being dumped
+    and how many of them have been written, so a resumed dump carries on
+    with exactly the ids that haven't been, even if ids were added or
+    removed in between; new ids are dumped at the end. CSV columns are
+    taken from the first page and kept in the checkpoint too, so a resumed
+    dump writes under the same header. A record with a field outside them
+    fails the dump rather than losing the field.
+    """
+    def __init__(self, session, endpoint, args):
+        self._session = session
+        self._endpoint = endpoint
+        self._args = args
+        self._params = {'lang': args.lang} if args.lang else {}
+        self._columns = None
+        self._writer = None
+        self._ids = None
+
+    def _pages(self, done):
+        """
+        Work out the requests that make up the rest of the dump, adding any
+        ids that are new since the checkpoint to the end of self._ids.
+
+        Args:
+            done (int): Ids (or for endpoints that aren't bulk, pages)
+                already written, from the checkpoint.
+
+        Returns (list):
+            (request parameters, number of ids) for each page still to
+            write.
+        """
+        if not self._endpoint.bulk:
+            return [] if done else [(dict(self._params), 1)]
+        ids = sorted(self._session.make_request(self._endpoint.path,
+                                                params=self._params))
+        if self._ids is None:
+            self._ids = ids
+        else:
+            known = set(self._ids)
+            self._ids.extend(i for i in ids if i not in known)
+        todo = self._ids[done:]
+        size = min(self._args.page_size or self._endpoint.page_size,
+                   self._endpoint.page_size)
+        return [
+            ({**self._params,
+              'ids': ','.join(str(i) for i in todo[n:n + size])},
+             len(todo[n:n + size]))
+            for n in range(0, len(todo), size)
+        ]
+
+    def _fetch(self, params):
+        """Fetch a single page as a list of records."""
+        records = self._session.make_request(self._endpoint.path,
+                                             params=params)
+        return records if isinstance(records, list) else [records]
+
+    def _load_checkpoint(self):
+        """
+        Get how much was already written, the ids being dumped and the CSV
+        columns they were written under, from --resume.
+
+        Returns (int):
+            Ids (or for endpoints that aren't bulk, pages) written.
+        """
+        path = self._args.resume
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, mode='r') as f:
+            checkpoint = loads(f.read())
+        if checkpoint.get('endpoint') != self._endpoint.path:
+            raise ValueError(f'{path} is a checkpoint for '
+                             f'{checkpoint.get("endpoint")}')
+        done = checkpoint.get('done', 0)
+        self._ids = checkpoint.get('ids')
+        if self._endpoint.bulk and done and self._ids is None:
+            raise ValueError(f'{path} has no ids to resume with')
+        self._columns = checkpoint.get('columns')
+        if self._args.format == 'csv' and done and not self._columns:
+            raise ValueError(f'{path} has no CSV columns to resume with')
+        return done
+
+    def _save_checkpoint(self, done):
+        """Record how much has been written, for --resume."""
+        if not self._args.resume:
+            return
+        tmp_path = f'{self._args.resume}.tmp'
+        with open(tmp_path, mode='w') as f:
+            f.write(dumps({'endpoint': self._endpoint.path, 'done': done,
+                           'ids': self._ids, 'columns': self._columns}))
+        os.replace(tmp_path, self._args.resume)
+
+    def _open_output(self, append):
+        """Open the output file, compressed if asked to."""
+        path = self._args.output
+        if path == '-':
+            return open(sys.stdout.fileno(), mode='w', encoding='utf-8',
+                        newline='', closefd=False)
+        mode = 'at' if append else 'wt'
+        if self._args.compress:
+            return _COMPRESSORS[self._args.compress](
+                path, mode=mode, encoding='utf-8', newline='')
+        return open(path, mode=mode, encoding='utf-8', newline='')
+
+    def _write(self, f, records, header):
+        """
+        Write a page of records in the chosen format.
+
+        Raises:
+            ValueError: If a record has a field that isn't a CSV column.
+        """
+        if self._args.format == 'jsonl':
+            for record in records:
+                f.write(dumps(record, ensure_ascii=False,
+                              separators=(',', ':')))
+                f.write('\n')
+            return
+        records = [r if isinstance(r, dict) else {'value': r}
+                   for r in records]
+        if self._columns is None:
+            self._columns = sorted({k for r in records for k in r})
+        columns = set(self._columns)
+        for record in records:
+            extra = set(record) - columns
+            if extra:
+                raise ValueError(
+                    f'Record {record.get("id")} has fields that are not CSV '
+                    f'columns: {sorted(extra)}. Dump it as jsonl instead.')
+        if self._writer is None:
+            self._writer = csv.DictWriter(f, self._columns)
+            if header:
+                self._writer.writeheader()
+        for record in records:
+            self._writer.writerow({
+                k: dumps(v, ensure_ascii=False)
+                if isinstance(v, (dict, list)) else v
+                for k, v in record.items()
+            })
+
+    def run(self):
+        """
+        Run the dump.
+
+        Returns (int):
+            Number of records written.
+        """
+        done = self._load_checkpoint()
+        pages = self._pages(done)
+        MODULE_LOG.info(f'Dumping {len(pages)} pages of '
+                        f'{self._endpoint.path}, {done} already written')
+        written = 0
+        window = max(1, self._args.concurrency) * 2
+        resumed = done > 0
+        with self._open_output(append=resumed) as f, \
+                ThreadPoolExecutor(self._args.concurrency) as pool:
+            todo = iter(pages)
+            pending = [(pool.submit(self._fetch, params), size)
+                       for params, size in islice(todo, window)]
+            while pending:
+                future, size = pending.pop(0)
+                records = future.result()
+                self._write(f, records, header=not resumed)
+                f.flush()
+                done += size
+                written += len(records)
+                self._save_checkpoint(done)
+                page = next(todo, None)
+                if page is not None:
+                    pending.append((pool.submit(self._fetch, page[0]),
+                                    page[1]))
+        MODULE_LOG.info(f'Wrote {written} records')
+        return written
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+        python -m GuildWars2API dump items --format jsonl -o items.jsonl.gz
+
+    Args:
+        argv (list, optional): Arguments. Defaults to None, which uses
+            sys.argv.
+
+    Returns (int):
+        Exit status.
+    """
+    dumpable = sorted(n for n, e in ENDPOINTS.items() if not e.templated)
+    parser = argparse.ArgumentParser(prog='python -m GuildWars2API')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log debug output.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser(
+        'dump', help='Stream a catalog or account resource to a file.')
+    dump.add_argument('resource', choices=dumpable,
+                      help='Endpoint to dump, by name.')
+    dump.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl',
+                      help='Output format. Nested values are written as JSON '
+                           'in CSV columns. Defaults to jsonl.')
+    dump.add_argument('-o', '--output', default='-',
+                      help='File to write. Defaults to stdout.')
+    dump.add_argument('--compress', choices=sorted(_COMPRESSORS),
+                      help='Compress the output file.')
+    dump.add_argument('--token-file',
+                      help='File containing the API key for account '
+                           'resources.')
+    dump.add_argument('--lang', help='Language of catalog text.')
+    dump.add_argument('--concurrency', type=int, default=4,
+                      help='Pages fetched at once. Defaults to 4.')
+    dump.add_argument('--page-size', type=int,
+                      help='Ids per page. Defaults to the endpoint maximum.')
+    dump.add_argument('--rate', type=float,
+                      help='Most requests per second.')
+    dump.add_argument('--timeout', type=float, default=60,
+                      help='Seconds before a request is abandoned.')
+    dump.add_argument('--resume', metavar='CHECKPOINT',
+                      help='Checkpoint file to resume from and update.')
+    args = parser.parse_args(argv)
+
     logging.basicConfig(
-        level=logging.INFO,
-        stream=sys.stdout,
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        stream=sys.stderr,
         format='%(asctime)s %(levelname)s - %(name)s - %(message)s'
     )
+    if args.resume and args.output == '-':
+        parser.error('--resume needs an --output file')
+    if args.compress and args.output == '-':
+        parser.error('--compress needs an --output file')
 
-    session = GW2APISession()
-    session.load_token('token.txt')
-
-    me = Account(session=session)
-    print(me.details)
-
-    # me.bank.refresh()
-    # print('Bank items:\n')
-    # for i in me.bank:
-    #     print(i.details)
-    #     print()
-
-    me.achievements.refresh()
-    print('Achievements:\n')
-    for a in me.achievements:
-        print(a.details)
-        print()
-
-    # me.characters.refresh()
-    # print('Characters:\n')
-    # for c in me.characters:
-    #     print(c.details)
-    #     for e in c.equipment:
-    #         print(e)
-    #     print()
+    session = GW2APISession(
+        rate_limiter=RateLimiter(args.rate) if args.rate else None,
+        timeout=args.timeout,
+    )
+    endpoint = ENDPOINTS[args.resource]
+    try:
+        if args.token_file:
+            session.load_token(args.token_file)
+        _Dumper(session, endpoint, args).run()
+    except (APIError, AuthorizationRequiredError, ValueError) as e:
+        MODULE_LOG.error(f'Dump failed: {e!r}')
+        return 1
+    except OSError as e:
+        parser.exit(1, f'{parser.prog}: error: {e}\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Compare a GW2List-style fan-out over HTTP/1.1 (urllib) and HTTP/2
+(HTTP2Transport) against a local stand-in for the API.
+
+The stand-in is a small ASGI app served by hypercorn, which speaks both
+HTTP/1.1 and cleartext HTTP/2 on the same port, and answers v2/items?id=
+after a fixed delay to stand in for network latency. It counts the
+connections each run opens.
+
+Needs httpx[http2] and hypercorn:
+
+    pip install httpx[http2] hypercorn
+    python benchmarks/http2_fanout.py --requests 50 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GuildWars2API import GW2APISession, HTTP2Transport  # noqa: E402
+
+try:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+except ImportError:
+    sys.exit('This benchmark needs hypercorn: pip install hypercorn')
+
+
+class StandIn(object):
+    """ASGI stand-in for v2/items."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.connections = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        self.connections.add(tuple(scope['client']))
+        await asyncio.sleep(self.latency)
+        query = dict(p.split('=', 1) for p in
+                     scope['query_string'].decode().split('&') if '=' in p)
+        body = json.dumps({'id': int(query.get('id', 0)),
+                           'name': f"Item {query.get('id')}"}).encode()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def start_server(app, port):
+    """Serve app on a background thread."""
+    config = Config()
+    config.bind = [f'127.0.0.1:{port}']
+    config.loglevel = 'WARNING'
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete,
+                     args=(serve(app, config),), daemon=True).start()
+    time.sleep(1)
+
+
+def fan_out(session, requests, workers):
+    """Make requests in parallel, the way GW2List.refresh() does."""
+    timer = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda i: session.make_request(
+            'v2/items', params={'id': i}), range(1, requests + 1)))
+    return time.perf_counter() - timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    app = StandIn(args.latency)
+    start_server(app, args.port)
+    GW2APISession._base_url = f'http://127.0.0.1:{args.port}'
+    sessions = {
+        'HTTP/1.1': GW2APISession(),
+        # The stand-in is cleartext, so talk HTTP/2 with prior knowledge.
+        'HTTP/2': GW2APISession(http2=HTTP2Transport(http1=False)),
+    }
+    print(f'{args.requests} parallel requests, {args.latency * 1000:g}ms '
+          f'latency, best of {args.rounds}')
+    for name, session in sessions.items():
+        fan_out(session, args.requests, args.requests)
+        app.connections.clear()
+        best = min(fan_out(session, args.requests, args.requests)
+                   for _ in range(args.rounds))
+        print(f'{name:>9}: {best * 1000:8.1f}ms  '
+              f'{len(app.connections) / args.rounds:6.1f} connections/round')
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Memory footprint benchmarks for the object graphs the library builds, run
+against generated fixture data with no network access.
+
+Each scenario is measured with tracemalloc, which reports the bytes still
+allocated once the objects are built (divided by the number of objects
+built), and the peak while building them. A scenario over its threshold
+fails the run, so footprint regressions show up as a non-zero exit:
+
+    python benchmarks/memory.py
+
+The thresholds hold for the default fixture sizes only. Runs with other
+sizes report their numbers without a pass or fail:
+
+    python benchmarks/memory.py --scenario bank --items 2000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from urllib.parse import parse_qs, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GuildWars2API as gw2  # noqa: E402
+
+
+# Fixture sizes the thresholds were measured with.
+DEFAULT_SIZES = {'items': 20000, 'characters': 60, 'bank_slots': 500}
+
+# Most bytes per object and peak bytes allowed per scenario, with the
+# default fixture sizes. About 25% over what they measured when set.
+THRESHOLDS = {
+    'catalog': {'per_object': 2500, 'peak': 48 * 2 ** 20},
+    'account': {'per_object': 700, 'peak': 6 * 2 ** 20},
+    'bank': {'per_object': 3900, 'peak': 2 * 2 ** 20},
+}
+
+
+class Fixtures(object):
+    """Generated API responses, shaped like the real ones."""
+    def __init__(self, items=DEFAULT_SIZES['items'],
+                 characters=DEFAULT_SIZES['characters'],
+                 bank_slots=DEFAULT_SIZES['bank_slots']):
+        self.items = {i: {
+            'id': i, 'name': f'Item {i}', 'type': 'Weapon', 'level': i % 80,
+            'rarity': 'Exotic', 'vendor_value': i % 1000,
+            'chat_link': f'[&AgH{i:06d}AAA=]', 'icon':
+            f'https://render.guildwars2.com/file/{i:040X}/{i}.png',
+            'description': f'A fixture item, number {i}.',
+            'game_types': ['Activity', 'Dungeon', 'Pve', 'Wvw'],
+            'flags': ['HideSuffix', 'NoSalvage'], 'restrictions': [],
+            'details': {'type': 'Sword', 'damage_type': 'Physical',
+                        'min_power': 905, 'max_power': 1000,
+                        'defense': 0, 'infusion_slots': []},
+        } for i in range(1, items + 1)}
+        self.recipes = {i: {
+            'id': i, 'type': 'Sword', 'output_item_id': i,
+            'output_item_count': 1, 'min_rating': 400,
+            'time_to_craft_ms': 1000, 'disciplines': ['Weaponsmith'],
+            'flags': [], 'ingredients': [{'item_id': i + 1, 'count': 5}],
+        } for i in range(1, 501)}
+        self.characters = {f'Character {n}': {
+            'name': f'Character {n}', 'race': 'Human', 'gender': 'Female',
+            'profession': 'Guardian', 'level': 80, 'guild': 'GUILD-1',
+            'age': 1000000, 'created': '2015-01-01T00:00:00Z', 'deaths': 10,
+            'recipes': list(range(1, 101)),
+            'equipment': [{'id': 1 + (n * 16 + s) % items, 'slot': f'S{s}'}
+                          for s in range(16)],
+            'bags': [{'id': 8932, 'size': 20, 'inventory': [
+                {'id': 1 + (n * 20 + s) % items, 'count': 1}
+                for s in range(20)]} for _ in range(5)],
+        } for n in range(characters)}
+        self.bank = [{'id': 1 + s % items, 'count': 1 + s % 250}
+                     if s % 7 else None for s in range(bank_slots)]
+
+    def respond(self, url, params):
+        """Get the decoded response for a request."""
+        ids = params.get('ids')
+        if url == 'v2/tokeninfo':
+            return {'id': 'fixture', 'name': 'fixture', 'permissions': [
+                'account', 'inventories', 'characters', 'progression',
+                'wallet', 'guilds', 'builds', 'unlocks']}
+        if url == 'v2/account':
+            return {'id': 'fixture', 'name': 'Fixture.1234', 'world': 1001,
+                    'guilds': ['GUILD-1'], 'created': '2015-01-01'}
+        if url == 'v2/worlds':
+            return {'id': 1001, 'name': 'Anvil Rock', 'population': 'High'}
+        if url == 'v2/guild/GUILD-1':
+            return {'id': 'GUILD-1', 'name': 'Fixture Guild', 'tag': 'FIX'}
+        if url == 'v2/account/bank':
+            return self.bank
+        if url == 'v2/account/achievements':
+            return []
+        if url == 'v2/characters':
+            if ids == 'all':
+                return list(self.characters.values())
+            return list(self.characters)
+        for path, table in (('v2/items', self.items),
+                            ('v2/recipes', self.recipes)):
+            if url == path:
+                if 'id' in params:
+                    return table[int(params['id'])]
+                if ids is None:
+                    return list(table)
+                if ids == 'all':
+                    return list(table.values())
+                return [table[int(i)] for i in ids.split(',')
+                        if int(i) in table]
+        raise gw2.APIError(f'No fixture for {url}')
+
+
+class FixtureSession(gw2.GW2APISession):
+    """A session that answers from Fixtures instead of the network."""
+    def __init__(self, fixtures, **kwargs):
+        self.fixtures = fixtures
+        super(FixtureSession, self).__init__(**kwargs)
+
+    def _fetch(self, url, params, data, headers, limited=True,
+               timing=None):
+        if timing is not None:
+            timing.append(time.monotonic())
+        params = {k: v[0] for k, v in parse_qs(urlencode(params or {},
+                                                         safe=',')).items()}
+        body = json.dumps(self.fixtures.respond(url, params)).encode()
+        if timing is not None:
+            timing.append(time.monotonic())
+        return body
+
+
+def _session(fixtures):
+    session = FixtureSession(fixtures)
+    session.token = 'fixture'
+    return session
+
+
+def catalog(fixtures):
+    """Every item in the catalog, as Items objects."""
+    items = gw2.Items(session=_session(fixtures)).get(list(fixtures.items))
+    return items, len(items)
+
+
+def account(fixtures):
+    """An Account with every character hydrated."""
+    acc = gw2.Account(session=_session(fixtures))
+    characters = list(acc.characters)
+    objects = 1 + len(characters) + sum(
+        1 + len(list(c.recipes)) + len(list(c.equipment))
+        for c in characters)
+    return acc, objects
+
+
+def bank(fixtures):
+    """A hydrated Bank."""
+    b = gw2.Bank(session=_session(fixtures))
+    b.refresh()
+    return b, b.count
+
+
+SCENARIOS = {'catalog': catalog, 'account': account, 'bank': bank}
+
+
+def measure(scenario, fixtures):
+    """
+    Build a scenario's objects under tracemalloc.
+
+    Returns (tuple):
+        (bytes per object, peak bytes, number of objects)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        built, objects = scenario(fixtures)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del built
+    return (current - baseline) / max(objects, 1), peak - baseline, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS),
+                        action='append', help='Scenario to run (default all)')
+    parser.add_argument('--items', type=int,
+                        default=DEFAULT_SIZES['items'])
+    parser.add_argument('--characters', type=int,
+                        default=DEFAULT_SIZES['characters'])
+    parser.add_argument('--bank-slots', type=int,
+                        default=DEFAULT_SIZES['bank_slots'])
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args.items, args.characters, args.bank_slots)
+    checked = all(getattr(args, k) == v for k, v in DEFAULT_SIZES.items())
+    if not checked:
+        print('Fixture sizes differ from the defaults, so thresholds are '
+              'not applied.')
+    failed = []
+    print(f'{"scenario":>10} {"objects":>8} {"bytes/object":>13} '
+          f'{"peak MiB":>9}')
+    for name in args.scenario or SCENARIOS:
+        per_object, peak, objects = measure(SCENARIOS[name], fixtures)
+        limit = THRESHOLDS[name]
+        over = checked and (per_object > limit['per_object']
+                            or peak > limit['peak'])
+        print(f'{name:>10} {objects:8d} {per_object:13.0f} '
+              f'{peak / 2 ** 20:9.2f}{"  OVER THRESHOLD" if over else ""}')
+        if over:
+            failed.append(name)
+    if failed:
+        print(f'Footprint regressed in: {", ".join(failed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())